@@ -5,6 +5,20 @@ import sys
 import os
 import color
 
+# disk controller commands, defined in every program unless a const of the same name replaces them
+DISK_COMMANDS = {
+    "disk_cmd_set_sector": 0x10, # then 4 bytes of sector number to the data port
+    "disk_cmd_set_count": 0x11, # then 4 bytes of sector count to the data port
+    "disk_cmd_set_vector": 0x12, # then 2 bytes of interrupt id to the data port, 0 for none
+    "disk_cmd_read": 0x20, # one sector
+    "disk_cmd_write": 0x21,
+    "disk_cmd_read_run": 0x22, # count sectors from the current one
+    "disk_cmd_write_run": 0x23,
+    "disk_cmd_ack": 0x30, # clear the error
+    "disk_cmd_flush": 0x40, # push written sectors out to the image
+    "disk_cmd_abort": 0xFF,
+}
+
 class parsingError(Exception):
     def __init__(self, *args):
         super().__init__(*args)
@@ -13,7 +27,7 @@ class Assembler:
     def __init__(self, name:str=None, verbose=False):
         self.verbose = verbose
         self.name = os.path.abspath(name) if name else "main"
-        self.const = {}
+        self.const = dict(DISK_COMMANDS)
         self.mnemonicToClass:dict[(str,Command)] = {
             # Halt
             "halt": Halt,
@@ -370,10 +384,10 @@ if __name__ == "__main__":
         code = sourcefile.read()
 
     output = assembler.main(code)
-    constants:dict[str,int] = assembler.const
+    constants:dict[str,int] = {name: value for name, value in assembler.const.items() if DISK_COMMANDS.get(name) != value}
     print("\nConstants used:")
     maxlen = len(str(len(constants)))
-    maxnamelen = max([len(item) for item in constants.keys()])
+    maxnamelen = max([len(item) for item in constants.keys()], default=0)
     maxlinelen = 0
     for idx, (name,value) in enumerate(constants.items()):
         if is_ascii_printable_byte(value):
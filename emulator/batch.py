@@ -0,0 +1,81 @@
+from main import Emulator
+from device import inputExhausted
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import time
+import sys
+import os
+
+def run_job(job:dict) -> dict:
+    "Boot one image with one stdin, over an overlay so jobs never see each other's writes"
+    result = {"id": job["id"], "image": job["image"]}
+    output = bytearray()
+    emulator = Emulator()
+    emulator.ram.max_pages = job.get("max_pages")
+
+    begin = time.perf_counter_ns()
+    try:
+        emulator.boot(job["image"], job.get("stdin", ""), output=output, overlay=True)
+        emulator.run(instructions=job.get("limit"))
+        stop = "halt" if emulator.halt_type is not None else "limit"
+    except inputExhausted:
+        stop = "input"
+    except FileNotFoundError:
+        stop = "error"
+        result["error"] = f"Disk image \"{job['image']}\" not found"
+    # one broken job must not take the rest of the batch down with it
+    except Exception as E:
+        stop = "error"
+        result["error"] = str(E) or E.__class__.__name__
+    finally:
+        emulator.close()
+    wall_time = time.perf_counter_ns() - begin
+
+    result.update({
+        "output": output.decode("latin-1"),
+        "stop": stop,
+        "halt_type": emulator.halt_type,
+        "instructions": emulator.executed,
+        "wall_time_ns": wall_time,
+    })
+    return result
+
+def read_manifest(path:str) -> list[dict]:
+    "One JSON object per line with an image, and optionally stdin, a limit and max_pages"
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job["id"] = job.get("id", len(jobs))
+            job["image"] = os.path.join(base, job["image"])
+            jobs.append(job)
+    return jobs
+
+def main(manifest:str, workers:int=None, output=sys.stdout):
+    jobs = read_manifest(manifest)
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(jobs) // (workers * 4))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(run_job, jobs, chunksize=chunksize):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="gArch64 emulator batch runner")
+
+    parser.add_argument("manifest", help="JSON lines file, each line an object with `image`, and optionally `stdin`, `limit`, `max_pages` and `id`")
+    parser.add_argument("-w", "--workers", help="number of worker processes, defaults to the number of logical processors", type=int, default=None)
+    parser.add_argument("-o", "--output", help="write results here instead of to the console", default=None)
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output,"w") as results:
+            main(args.manifest, args.workers, results)
+    else:
+        main(args.manifest, args.workers)
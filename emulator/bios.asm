@@ -21,6 +21,8 @@ intr 0x12, offset + input
 intr 0x13, offset + disk_set_sector
 intr 0x14, offset + disk_read
 intr 0x15, offset + disk_write
+intr 0x16, offset + disk_read_run
+intr 0x17, offset + disk_write_run
 
 ; define the fault handlers
 intr 0x100, offset + intfault
@@ -41,6 +43,7 @@ ajmp [0x0]
 ; A is the sector number
 disk_set_sector:
     pushr 
+    call disk_wait
     mov x, x10
     mov [disk_com], x
     mov x, a
@@ -72,6 +75,7 @@ ret
 ; A is the source address in memory to read from
 disk_write:
     pushr 
+    call disk_wait
     mov x, a
     mov a, 0x21
     mov [disk_com], a
@@ -92,8 +96,10 @@ ret
 disk_read:
     pushr 
     mov x, a
+    call disk_wait
     mov a, 0x20
     mov [disk_com], a
+    call disk_wait
     mov y, 1
 
     readloop:
@@ -107,6 +113,76 @@ disk_read:
     popr 
 ret 
 
+; returns once the controller is done with a command it finishes in the background
+disk_wait:
+    pushr 
+    waitloop:
+        mov a, [disk_stat]
+        cmp a, 0x24
+        jz waitloop
+    popr 
+ret 
+
+; X is the number of sectors for the next read/write run
+disk_set_count:
+    pushr 
+    call disk_wait
+    mov a, disk_cmd_set_count
+    mov [disk_com], a
+    mov [disk_data], x
+    shrb 
+    mov x, a
+    mov [disk_data], x
+    shrb 
+    mov x, a
+    mov [disk_data], x
+    shrb 
+    mov x, a
+    mov [disk_data], x
+    popr 
+ret 
+
+; A is the source address in memory to read from, X is the number of sectors
+disk_write_run:
+    pushr 
+    call disk_set_count
+    mov x, a
+    mov a, disk_cmd_write_run
+    mov [disk_com], a
+    mov y, 1
+
+    writerunloop:
+        ldv 
+        mov [disk_data], a
+        add 
+        mov x, a
+        mov a, [disk_stat]
+        cmp a, 0
+        jnz writerunloop
+    popr 
+ret 
+
+; A is the target address in memory to save to, X is the number of sectors
+disk_read_run:
+    pushr 
+    call disk_set_count
+    mov x, a
+    mov a, disk_cmd_read_run
+    mov [disk_com], a
+    call disk_wait
+    mov y, 1
+
+    readrunloop:
+        mov a, [disk_data]
+        stv 
+        add 
+        mov x, a
+        mov a, [disk_stat]
+        cmp a, 0
+        jnz readrunloop
+    popr 
+ret 
+
 ; trailing newline not included
 input:
     pushr 
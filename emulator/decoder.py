@@ -0,0 +1,149 @@
+from typing import TYPE_CHECKING
+from device import INTERRUPT_RETURN
+
+# operands of these are offsets from the start of the instruction
+RELATIVE = {"JMP","JZ","JNZ","JC","JNC","CALL","BZ","BNZ","BC","BNC"}
+
+class Decoder:
+    "Decodes instructions once and caches them by program counter"
+    def __init__(self, emulator:"Emulator"):
+        self.emulator = emulator
+        self.ram = emulator.ram
+
+        # pc -> (handler, variant, params, length)
+        self.cache:dict[int,tuple] = {}
+        # address -> every cached pc with a byte at that address
+        self.owners:dict[int,list[int]] = {}
+        # page -> number of cached instruction bytes in that page
+        self.pages:dict[int,int] = {}
+
+        # opcode byte -> (operand count, signed)
+        self.layout:list[tuple[int,bool]] = [(0,False)]*256
+        for code, info in emulator.opcodes.OPCODES.items():
+            self.layout[code] = (len(info["operands"]), info["mnemonic"] in RELATIVE)
+
+        self.ram.code_pages = self.pages
+        self.ram.on_code_write = self.invalidate
+
+        # told about every dropped pc, and about flushes (with None)
+        self.on_drop = None
+
+        # joins common instruction sequences into one entry when set
+        self.fusion = None
+
+    def read(self, pc:int):
+        "Decode the instruction at pc without caching it"
+        size = self.emulator.blocksize
+
+        span = self.ram.fetch(pc, 2)
+        if span:
+            frame, offset = span
+            count, signed = self.layout[frame[offset]]
+            length = 2 + count*2*size
+            span = self.ram.fetch(pc, length)
+        if span:
+            frame, offset = span
+            params = []
+            for start in range(offset+2, offset+length, 2*size):
+                val = int.from_bytes(frame[start:start+2*size], "little")
+                if signed and val & (1 << (size * 16 - 1)):
+                    val = val - (1 << (size * 16))
+                params.append(val)
+            return frame[offset], frame[offset+1], tuple(params), length
+
+        # across a page or through device ports, one byte at a time
+        load = self.ram.load
+        opcode = load(pc)
+        variant = load(pc+1)
+        count, signed = self.layout[opcode]
+
+        params = []
+        address = pc+2
+        for _ in range(count):
+            val = 0
+            for idx in range(size):
+                val |= (load(address) | (load(address+1) << 8)) << (idx*16)
+                address += 2
+            if signed and val & (1 << (size * 16 - 1)):
+                val = val - (1 << (size * 16))
+            params.append(val)
+
+        return opcode, variant, tuple(params), address - pc
+
+    def single(self, pc:int):
+        "Decode one instruction without fusing or caching it"
+        if pc == INTERRUPT_RETURN:
+            return (self.emulator.interrupt_return, 0, (), 0)
+        opcode, variant, params, length = self.read(pc)
+        return (self.emulator.executor.table[opcode], variant, params, length)
+
+    def decode(self, pc:int):
+        # in device space, so never cached and only ever seen here
+        if pc == INTERRUPT_RETURN:
+            return (self.emulator.interrupt_return, 0, (), 0)
+
+        opcode, variant, params, length = self.read(pc)
+        entry = (self.emulator.executor.table[opcode], variant, params, length)
+
+        if self.fusion is not None:
+            entry = self.fusion.fuse(pc, entry, opcode) or entry
+            length = entry[3]
+        address = pc + length
+
+        mask = self.ram.mask
+        first = (pc & mask) >> 12
+        last = ((address-1) & mask) >> 12
+        # never cache code fetched through device ports
+        if first in self.ram.device_pages or last in self.ram.device_pages:
+            return entry
+
+        self.cache[pc] = entry
+        for byte in range(pc, address):
+            byte &= mask
+            if byte in self.owners:
+                self.owners[byte].append(pc)
+            else:
+                self.owners[byte] = [pc]
+            page = byte >> 12
+            if page not in self.pages:
+                self.ram.evict(page)
+            self.pages[page] = self.pages.get(page, 0) + 1
+
+        return entry
+
+    def invalidate(self, address:int):
+        "Drop every cached instruction overlapping a byte that was written to"
+        for pc in list(self.owners.get(address, ())):
+            self.drop(pc)
+
+    def invalidate_page(self, page:int):
+        "Drop every cached instruction with a byte in a page"
+        start = page << 12
+        for address in range(start, start + 0x1000):
+            if address in self.owners:
+                self.invalidate(address)
+
+    def drop(self, pc:int):
+        length = self.cache.pop(pc)[3]
+        if self.on_drop:
+            self.on_drop(pc)
+        for byte in range(pc, pc+length):
+            byte &= self.ram.mask
+            owners = self.owners[byte]
+            owners.remove(pc)
+            if not owners:
+                del self.owners[byte]
+            page = byte >> 12
+            self.pages[page] -= 1
+            if not self.pages[page]:
+                del self.pages[page]
+
+    def flush(self):
+        self.cache.clear()
+        self.owners.clear()
+        self.pages.clear()
+        if self.on_drop:
+            self.on_drop(None)
+
+if TYPE_CHECKING:
+    from main import Emulator
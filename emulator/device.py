@@ -1,7 +1,16 @@
 import sys
 import threading
 import os
+import mmap
+import select
+import selectors
+import socket
+import stat
+import time
+import weakref
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import TYPE_CHECKING
 
 class Port:
     def __init__(self):
@@ -12,8 +21,40 @@ class Port:
         return
 
     def read(self) -> int:
-        "When the system attempts to read from the address this port is mapped to"
-        return
+        "When the system attempts to read from the address this port is mapped to, write-only and unused ports read as 0"
+        return 0
+
+class Bus:
+    "Memory-mapped device ports, each claimed address is bound straight to its port's handlers"
+    def __init__(self):
+        # address -> bound read/write handler of the port mapped there
+        self.readers:dict[int,object] = {}
+        self.writers:dict[int,object] = {}
+        # every page with at least one port in it, ram never backs these
+        self.pages:set[int] = set()
+
+    def claim(self, start:int, *ports:Port):
+        "Map ports to consecutive addresses from start"
+        for idx, port in enumerate(ports):
+            address = (start + idx) & 0xFFFF_FFFF
+            if address in self.readers:
+                raise ValueError(f"Address {address:X} is already claimed by a device")
+            self.readers[address] = port.read
+            self.writers[address] = port.write
+            self.pages.add(address >> 12)
+
+    def read(self, address:int):
+        "Unclaimed addresses in a device page read as 0"
+        try:
+            return self.readers[address]()
+        except KeyError:
+            return 0
+
+    def write(self, address:int, value:int):
+        "Writes to unclaimed addresses in a device page are dropped"
+        handler = self.writers.get(address)
+        if handler is not None:
+            handler(value)
 
 class Device:
     "Base Device"
@@ -21,16 +62,75 @@ class Device:
         pass
     def set_port(self, register_port:object):
         pass
+    def snapshot(self):
+        "Whatever restore() needs to put the device back the way it is now"
+        return None
+    def restore(self, state):
+        pass
+    def sync(self):
+        "Write out anything held back, done when the guest halts"
+        pass
+    def close(self):
+        "Let go of whatever the device holds on the host, done once the machine is no longer needed"
+        pass
+
+    def field(self, name:str, idx:int, mask:int=None) -> Port:
+        "Port for byte idx of a little endian register kept in attribute name, only the bits in mask are kept"
+        shift = idx*8
+        port = Port()
+        def read():
+            return (getattr(self, name) >> shift) & 0xFF
+        def write(data:int):
+            value = (getattr(self, name) & ~(0xFF << shift)) | ((data & 0xFF) << shift)
+            setattr(self, name, value if mask is None else value & mask)
+        port.read = read
+        port.write = write
+        return port
+
+# the IVT holds 512 handlers, vector registers keep only the bits of an id inside it
+VECTOR_MASK = 0x1FF
+
+class inputExhausted(KeyboardInterrupt):
+    "The guest read past the end of the stdin it was given"
+    pass
 
 class SerialConsole(Device):
     "Serial Console"
-    def __init__(self, stdin:str=None):
+    def __init__(self, stdin:str=None, output:bytearray=None, raw:bool=False, source:"int|object"=None):
         self.writemode = False
         self.listen = False
         self.buffer:deque[int] = deque()
-        if not stdin:
-            listener = threading.Thread(target=self.keyboard, daemon=True)
-            listener.start()
+        # collects what the guest prints instead of stdout
+        self.output = output
+
+        # what the guest printed and stdout hasn't seen yet, written out on a newline, when the guest reads,
+        # on halt, once it reaches flush_size or once it sat there for flush_after seconds, checked between
+        # run slices, on interrupts and on every write
+        self.unflushed = bytearray()
+        self.flush_size = 4096
+        self.flush_after = 0.05
+        self.flush_lock = threading.Lock()
+        # when the oldest byte in unflushed was printed
+        self.printed = 0.0
+        # bytes go to stdout as they are instead of as the characters of the same number
+        self.raw = raw
+
+        # a guest reading an empty console this many times in a row with nothing printed in between
+        # is polling for input, and from then on each empty read waits up to idle_wait seconds for some
+        self.idle_after = 64
+        self.idle_wait = 0.05
+        self.empty_reads = 0
+        # time.monotonic() a timed run ends at, the waits don't go past it
+        self.deadline:float = None
+
+        # input is taken from the source in batches of up to batch_size bytes, between run slices
+        # and on an empty read once drain_every seconds have passed since the last batch
+        self.batch_size = 4096
+        self.drain_every = 0.01
+        self.drained = 0.0
+        self.selector = None
+        if stdin is None:
+            self.open_input(source)
             self.false = False
         else:
             self.buffer = deque(stdin.encode(encoding="ascii"))
@@ -43,40 +143,322 @@ class SerialConsole(Device):
         self.port.read = self.read
         register_port(self.port)
 
+    def snapshot(self):
+        return (self.buffer.copy(), None if self.output is None else len(self.output))
+
+    def restore(self, state):
+        buffer, output_length = state
+        self.buffer = buffer.copy()
+        if output_length is not None:
+            del self.output[output_length:]
+
+    def open_input(self, source:"int|object"):
+        "Start taking input, from stdin unless a source is given"
+        self.attach(sys.stdin if source is None else source)
+
+    def close(self):
+        "Write out the rest of the output and stop taking input, done when the emulator exits"
+        self.flush()
+        self.detach()
+
+    def attach(self, source:"int|object"):
+        "Take input from a readable file descriptor, or anything with a fileno(), such as a pipe, pty or socket"
+        self.detach()
+        self.fd = source if isinstance(source, int) else source.fileno()
+        self.selector = selectors.DefaultSelector()
+        try:
+            self.selector.register(self.fd, selectors.EVENT_READ)
+        except PermissionError:
+            # epoll refuses regular files and /dev/null, select() takes them and finds them always readable
+            self.selector.close()
+            self.selector = selectors.SelectSelector()
+            self.selector.register(self.fd, selectors.EVENT_READ)
+
+    def detach(self):
+        "Stop taking input, what already arrived stays readable"
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+
     # yes the newline does get sent
-    def keyboard(self):
-        while 1:
-            try:
-                char = ord(sys.stdin.read(1))
-            except TypeError:
-                continue
-            self.buffer.append(char)
+    def drain(self):
+        "Move one batch of waiting input into the buffer without blocking"
+        self.flush_idle()
+        if self.selector is None:
+            return
+        self.drained = time.monotonic()
+        if not self.selector.select(0):
+            return
+        data = os.read(self.fd, self.batch_size)
+        if not data:
+            # end of file, nothing more will come
+            self.detach()
+            return
+        self.buffer.extend(data)
+
+    def wait_time(self) -> float:
+        "How long one empty read of a polling guest may block, idle_wait cut short at the deadline"
+        if self.deadline is None:
+            return self.idle_wait
+        return max(0.0, min(self.idle_wait, self.deadline - time.monotonic()))
+
+    def wait_for_input(self):
+        "Block the polling guest until input arrives or idle_wait runs out"
+        if self.selector is None:
+            time.sleep(self.wait_time())
+            return
+        self.selector.select(self.wait_time())
+        self.drain()
 
     def write(self, data:int):
-        print(chr(data),end="",flush=True)
+        self.empty_reads = 0
+        if self.output is not None:
+            self.output.append(data)
+            return
+        with self.flush_lock:
+            if not self.unflushed:
+                self.printed = time.monotonic()
+            self.unflushed.append(data)
+        if data == 10 or len(self.unflushed) >= self.flush_size:
+            self.flush()
+        else:
+            self.flush_idle()
+
+    def flush(self):
+        "Write out everything the guest printed so far"
+        with self.flush_lock:
+            if not self.unflushed:
+                return
+            data = bytes(self.unflushed)
+            self.unflushed.clear()
+            if self.raw:
+                sys.stdout.flush()
+                sys.stdout.buffer.write(data)
+                sys.stdout.buffer.flush()
+            else:
+                sys.stdout.write(data.decode("latin-1"))
+                sys.stdout.flush()
+
+    def flush_idle(self):
+        "Write out output that has been waiting for a newline for flush_after seconds"
+        if self.unflushed and time.monotonic() - self.printed >= self.flush_after:
+            self.flush()
+
+    def sync(self):
+        self.flush()
 
     def read(self):
+        if self.unflushed:
+            self.flush()
         if self.false:
             try:
-                print(chr(self.buffer[0]),end="",flush=True)
+                self.write(self.buffer[0])
             except IndexError:
-                raise KeyboardInterrupt
+                raise inputExhausted
         try:
-            return self.buffer.popleft()
+            value = self.buffer.popleft()
         except IndexError:
+            self.empty_reads += 1
+            if self.empty_reads >= self.idle_after:
+                self.wait_for_input()
+            elif self.selector is not None and time.monotonic() - self.drained >= self.drain_every:
+                self.drain()
             return 0
+        self.empty_reads = 0
+        return value
+
+class SocketConsole(SerialConsole):
+    "Serial console served on a Unix domain socket or a TCP port, a client can attach and detach while the machine runs"
+    def __init__(self, address:"str|tuple[str,int]"):
+        # output kept while nobody is attached, and how far a slow client may fall behind before the guest waits for it
+        self.backlog = 65536
+        self.client = None
+        super().__init__(raw=True, source=address)
+
+    def open_input(self, address:"str|tuple[str,int]"):
+        "Listen on address, a path for a Unix domain socket or a (host, port) pair for TCP"
+        if isinstance(address, str):
+            # a socket left behind by an earlier run
+            if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+                os.unlink(address)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(1)
+        self.server.setblocking(False)
+        self.address = self.server.getsockname()
+
+        self.listener = selectors.DefaultSelector()
+        self.listener.register(self.server, selectors.EVENT_READ)
+
+    def close(self):
+        super().close()
+        self.listener.close()
+        self.server.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def accept(self):
+        "Let a waiting client in, it takes over from the one attached before"
+        try:
+            client, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        client.setblocking(False)
+        self.attach(client)
+        self.client = client
+        self.flush()
+
+    def detach(self):
+        "Drop the client, the machine keeps running and its output is kept for the next one"
+        super().detach()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def drain(self):
+        "Let a waiting client in, then move one batch of its input into the buffer"
+        self.drained = time.monotonic()
+        self.flush_idle()
+        if self.listener.select(0):
+            self.accept()
+        if self.client is None or not self.selector.select(0):
+            return
+        try:
+            data = self.client.recv(self.batch_size)
+        except OSError:
+            data = b""
+        if not data:
+            # the client went away
+            self.detach()
+            return
+        self.buffer.extend(data)
+
+    def wait_for_input(self):
+        "Block the polling guest until input or a client arrives, or idle_wait runs out"
+        if self.client is None:
+            self.listener.select(self.wait_time())
+        else:
+            self.selector.select(self.wait_time())
+        self.drain()
+
+    def write(self, data:int):
+        super().write(data)
+        # let clients in even when the guest never reads
+        if self.client is None:
+            if time.monotonic() - self.drained >= self.drain_every:
+                self.drain()
+            return
+        # the client can't keep up, hold the guest until it takes some or someone else attaches
+        while self.client is not None and len(self.unflushed) >= self.backlog:
+            select.select([self.server], [self.client], [], self.idle_wait)
+            self.drain()
+            self.flush()
+
+    def flush(self):
+        "Send as much output as the client takes without blocking, the rest waits for the next flush"
+        with self.flush_lock:
+            client = self.client
+            if client is None:
+                # nobody to send it to, keep the latest backlog bytes for whoever attaches next
+                del self.unflushed[:-self.backlog]
+                return
+            if not self.unflushed:
+                return
+            try:
+                sent = client.send(self.unflushed)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                # the next drain finds out the client is gone
+                sent = 0
+            del self.unflushed[:sent]
+
+# path -> (inode, modification time and size the image was mapped at, the mapping)
+shared_images:dict[str,tuple[tuple[int,int,int],"mmap.mmap|bytes"]] = {}
+# every overlay disk still reading a shared image
+overlays:"weakref.WeakSet[DiskIO]" = weakref.WeakSet()
+
+class imageShared(Exception):
+    "An overlay was committed while other overlays still read the same image"
+    pass
+
+def shared_image(path:str) -> "mmap.mmap|bytes":
+    "Map an image read-only once per process, the OS shares the pages with every other process mapping it"
+    path = os.path.realpath(path)
+    info = os.stat(path)
+    # a file replaced or rewritten since it was mapped is mapped again
+    identity = (info.st_ino, info.st_mtime_ns, info.st_size)
+    cached = shared_images.get(path)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+    if not info.st_size:
+        image = b""
+    else:
+        with open(path,"rb") as file:
+            image = mmap.mmap(file.fileno(), info.st_size, access=mmap.ACCESS_READ)
+    shared_images[path] = (identity, image)
+    return image
 
 class DiskIO(Device):
     "Disk controller"
-    def __init__(self, diskpath:str=f"{os.path.dirname(__file__)}/disk.img"):
+    def __init__(self, diskpath:"str|bytes"=f"{os.path.dirname(__file__)}/disk.img", overlay:bool=False, interrupt:object=None):
         self.command = ""
         self.error = ""
-        self.databuffer = deque()
         self.sector = 0
         self.SECTORSIZE = 512 # bytes
-        self.disk = open(diskpath,"rb+")
+        # sectors moved by one READ_RUN or WRITE_RUN
+        self.count = 1
+
+        # bytes written to the data port for SET_SECTOR, SET_COUNT or WRITE so far
+        self.incoming = bytearray()
+        # sectors in the current READ or WRITE, and how many of them were written so far
+        self.run = 1
+        self.done = 0
+        # the sectors being read, sliced straight out of the image, and how far into them
+        self.transfer:memoryview = None
+        self.position = 0
+
+        # overlay mode: sector -> contents of every sector written, the image itself is never written.
+        # None when writes go straight to the image
+        self.delta:dict[int,bytearray] = None
+
+        self.path = None
+        self.file = None
+        if isinstance(diskpath, (bytes, bytearray, memoryview)):
+            # in-memory image, writes land in self.image
+            self.image = bytearray(diskpath)
+        elif overlay:
+            self.path = diskpath
+            self.image = shared_image(diskpath)
+            self.delta = {}
+            overlays.add(self)
+        else:
+            self.path = diskpath
+            self.file = open(diskpath,"rb+")
+            self.image = self.map()
+        # bytes on the disk, overlays can go past the end of the image
+        self.size = len(self.image)
+        # written sectors not yet pushed out to the file
+        self.dirty = False
+
+        # raises a hardware interrupt. with a vector set (SET_VECTOR), reads, write runs and flushes are
+        # finished on the worker thread while the controller reports busy, and the vector is raised once done
+        self.interrupt = interrupt
+        self.vector = 0
+        self.worker:ThreadPoolExecutor = None
+        self.job:Future = None
         super().__init__()
 
+    def map(self):
+        "The image file mapped into memory, an empty file can't be mapped so it starts as an empty buffer"
+        size = os.fstat(self.file.fileno()).st_size
+        if not size:
+            return bytearray()
+        return mmap.mmap(self.file.fileno(), size)
+
     def set_port(self, register_port):
         command = Port()
         command.write = self.get_command
@@ -92,43 +474,264 @@ class DiskIO(Device):
         register_port(data)
         register_port(status)
     
-    def get_size(self,file_object):
-        original_position = file_object.tell()
-        file_object.seek(0, os.SEEK_END)
-        size = file_object.tell()
-        file_object.seek(original_position)
-        return size
+    def snapshot(self):
+        self.wait()
+        # in-memory images and overlays are rolled back, files on disk keep their writes
+        image = bytes(self.image) if self.file is None and self.delta is None else None
+        delta = None if self.delta is None else {sector: bytes(data) for sector, data in self.delta.items()}
+        return (self.command, self.error, bytes(self.incoming), self.position, self.sector, self.count, self.run, self.done, self.vector, image, delta, self.size)
+
+    def restore(self, state):
+        self.wait()
+        self.command, self.error, incoming, self.position, self.sector, self.count, self.run, self.done, self.vector, image, delta, size = state
+        self.incoming = bytearray(incoming)
+        self.release()
+        if image is not None:
+            self.image[:] = image
+            self.size = size
+        if delta is not None:
+            self.delta = {sector: bytearray(data) for sector, data in delta.items()}
+            self.size = size
+        self.resume()
+
+    def sync(self):
+        "Push written sectors out to the image file"
+        self.wait()
+        self.flush()
+
+    def flush(self):
+        if self.dirty and isinstance(self.image, mmap.mmap):
+            self.image.flush()
+        self.dirty = False
+
+    def close(self):
+        self.wait()
+        if self.worker is not None:
+            self.worker.shutdown()
+            self.worker = None
+        overlays.discard(self)
+        # overlays map a shared image, only a file opened for this disk is let go of
+        if self.file is not None:
+            self.flush()
+            self.release()
+            if isinstance(self.image, mmap.mmap):
+                self.image.close()
+            self.file.close()
+            self.image = None
+            self.file = None
+
+    def wait(self):
+        "Let the command running on the worker thread finish"
+        job = self.job
+        if job is not None:
+            job.result()
+            self.job = None
+
+    def background(self, job:object):
+        "Finish the current command on the worker thread, the controller is busy until then"
+        self.command = "BUSY"
+        if self.worker is None:
+            self.worker = ThreadPoolExecutor(max_workers=1)
+        self.job = self.worker.submit(self.complete, job)
+
+    def complete(self, job:object):
+        try:
+            job()
+        except Exception:
+            # the image went away or can't be written, the guest sees an error instead of a busy controller
+            self.error = "IO_ERROR"
+            self.command = ""
+            self.release()
+        finally:
+            # raised before the job is done, so whoever waits on it finds the interrupt pending
+            self.interrupt(self.vector)
+
+    def load(self):
+        "Bring the sectors of a read in from the disk, touching every byte is what does it"
+        self.transfer = memoryview(bytes(self.slice(self.sector, self.run)))
+        self.position = 0
+        self.command = "READ"
+
+    def finish(self):
+        self.flush()
+        self.command = ""
+
+    def slice(self, sector:int, count:int=1) -> memoryview:
+        "count sectors from sector on, cut short at the end of the disk"
+        start = self.SECTORSIZE*sector
+        length = max(0, min(self.SECTORSIZE*count, self.size - start))
+        return self.overlaid(start, length)
+
+    def overlaid(self, start:int, length:int) -> memoryview:
+        "length bytes from start with written sectors laid over the image, only copied when some were written"
+        size = self.SECTORSIZE
+        first = start // size
+        last = (start + length - 1) // size
+        if not self.delta or not any(sector in self.delta for sector in range(first, last+1)):
+            if start + length <= len(self.image):
+                return memoryview(self.image)[start:start+length]
+
+        buffer = bytearray(length)
+        for sector in range(first, last+1):
+            begin = max(start, sector*size)
+            end = min(start + length, (sector+1)*size)
+            data = self.delta.get(sector) if self.delta else None
+            if data is not None:
+                buffer[begin-start:end-start] = data[begin - sector*size:end - sector*size]
+            elif begin < len(self.image):
+                piece = self.image[begin:min(end, len(self.image))]
+                buffer[begin-start:begin-start+len(piece)] = piece
+        return memoryview(buffer)
+
+    def release(self):
+        if self.transfer is not None:
+            self.transfer.release()
+            self.transfer = None
+
+    def resume(self):
+        "Slice a READ in progress again, after what was under it changed"
+        if self.command == "READ":
+            self.transfer = self.slice(self.sector, self.run)
+
+    def grow(self, size:int):
+        "Extend the image with zeros to size bytes, like writing past the end of a file does"
+        # a read in progress holds on to the image, it picks up where it was once it is remapped
+        self.release()
+        if self.file is None:
+            self.image.extend(bytes(size - len(self.image)))
+        else:
+            self.sync()
+            if isinstance(self.image, mmap.mmap):
+                self.image.close()
+            self.file.truncate(size)
+            self.image = self.map()
+        self.size = size
+        self.resume()
+
+    def view(self, start:int, length:int) -> memoryview:
+        "length bytes of the disk from start, without copying them when possible. None past the end of the disk"
+        if start + length > self.size:
+            return None
+        return self.overlaid(start, length)
+
+    def save(self, start:int, data:"bytes|memoryview"):
+        "Write data into the disk at start, extending it when needed"
+        if self.delta is not None:
+            self.save_overlay(start, data)
+            return
+        if start + len(data) > len(self.image):
+            self.grow(start + len(data))
+        self.image[start:start+len(data)] = data
+        self.size = len(self.image)
+        self.dirty = True
+
+    def save_overlay(self, start:int, data:"bytes|memoryview"):
+        size = self.SECTORSIZE
+        position = 0
+        while position < len(data):
+            sector, offset = divmod(start + position, size)
+            length = min(size - offset, len(data) - position)
+            block = self.delta.get(sector)
+            if block is None:
+                # a sector starts out as whatever the image has there
+                block = bytearray(self.image[sector*size:(sector+1)*size])
+                block.extend(bytes(size - len(block)))
+                self.delta[sector] = block
+            block[offset:offset+length] = data[position:position+length]
+            position += length
+        self.size = max(self.size, start + len(data))
+
+    def commit(self):
+        "Write an overlay's sectors into the image file, every later overlay of it starts from them"
+        if not self.delta:
+            return
+        # the others read the file through the same pages, it would change under them
+        path = os.path.realpath(self.path)
+        if any(disk is not self and os.path.realpath(disk.path) == path for disk in overlays):
+            raise imageShared(f"{self.path} is still used by another overlay")
+        self.release()
+        with open(self.path,"rb+") as file:
+            for sector, data in sorted(self.delta.items()):
+                offset = sector*self.SECTORSIZE
+                file.seek(offset)
+                file.write(data[:self.size - offset])
+        self.delta = {}
+        self.image = shared_image(self.path)
+        self.resume()
+
+    def discard(self):
+        "Drop an overlay's sectors, the disk reads as the image again"
+        if self.delta is None:
+            return
+        self.release()
+        self.delta = {}
+        self.size = len(self.image)
+        self.resume()
 
     def get_command(self, data:int):
+        if data == 0xFF: # abort, even while busy
+            self.abort()
+            return
         if self.command:
             return
 
         if data == 0x10:
             self.command = "SET_SECTOR"
-        elif data == 0x20:
+            self.incoming = bytearray()
+        elif data == 0x11:
+            self.command = "SET_COUNT"
+            self.incoming = bytearray()
+        elif data in (0x20, 0x22): # one sector, or a run of count sectors
+            self.run = 1 if data == 0x20 else self.count
+            if not self.run:
+                return
             self.command = "READ"
-            self.disk.seek(self.SECTORSIZE*self.sector)
-            self.databuffer = deque(self.disk.read(self.SECTORSIZE))
-        elif data == 0x21:
+            self.release()
+            if self.vector and self.interrupt:
+                self.background(self.load)
+                return
+            self.transfer = self.slice(self.sector, self.run)
+            self.position = 0
+        elif data in (0x21, 0x23):
+            self.run = 1 if data == 0x21 else self.count
+            if not self.run:
+                return
             self.command = "WRITE"
-            self.disk.seek(self.SECTORSIZE*self.sector)
-
+            self.done = 0
+            self.incoming = bytearray()
+        elif data == 0x12:
+            self.command = "SET_VECTOR"
+            self.incoming = bytearray()
+        elif data == 0x40: # flush
+            if self.vector and self.interrupt:
+                self.background(self.finish)
+                return
+            self.sync()
 
         elif data == 0x30: # error ACK
             self.error = ""
-        elif data == 0xFF: # abort
-            self.command = ""
-            self.error = ""
-            self.databuffer = deque()
 
         else:
             self.error = "INVALID_COMMAND"
 
+    def abort(self):
+        "Drop the current command, one on the worker thread is called off if it hasn't started and waited for if it has"
+        job = self.job
+        if job is not None and job.cancel():
+            self.job = None
+        self.wait()
+        self.command = ""
+        self.error = ""
+        self.incoming = bytearray()
+        self.release()
+
     def status(self):
         if self.error == "INVALID_COMMAND":
             return 0x30
         elif self.error == "SECTOR_ID_TOO_LARGE":
             return 0x31
+        elif self.error == "IO_ERROR":
+            return 0x32
 
 
         if self.command == "READ":
@@ -137,6 +740,12 @@ class DiskIO(Device):
             return 0x21
         elif self.command == "SET_SECTOR":
             return 0x22
+        elif self.command == "SET_COUNT":
+            return 0x23
+        elif self.command == "BUSY":
+            return 0x24
+        elif self.command == "SET_VECTOR":
+            return 0x25
         elif not self.command:
             return 0
 
@@ -145,12 +754,15 @@ class DiskIO(Device):
             return 0
 
         if self.command == "READ":
-            try:
-                if len(self.databuffer) == 1:
-                    self.command = ""
-                return self.databuffer.popleft()
-            except IndexError:
+            # past the end of the image there is nothing to read, and the command never finishes
+            if self.position >= len(self.transfer):
                 return 0
+            value = self.transfer[self.position]
+            self.position += 1
+            if self.position == len(self.transfer):
+                self.command = ""
+                self.release()
+            return value
         
         else:
             return 0
@@ -160,17 +772,207 @@ class DiskIO(Device):
             return
 
         if self.command == "WRITE":
-            self.databuffer.append(data)
-            if len(self.databuffer) >= self.SECTORSIZE:
-                self.command = ""
-                self.disk.write(bytearray(self.databuffer))
-                self.disk.flush()
-                self.databuffer = deque()
+            self.incoming.append(data & 0xFF)
+            if len(self.incoming) >= self.SECTORSIZE:
+                self.save(self.SECTORSIZE*(self.sector + self.done), self.incoming)
+                self.incoming = bytearray()
+                self.done += 1
+                if self.done == self.run:
+                    self.command = ""
+                    if self.vector and self.interrupt:
+                        self.background(self.finish)
         elif self.command == "SET_SECTOR":
-            self.databuffer.append(data)
-            if len(self.databuffer) == 4:
-                self.sector = int.from_bytes(bytes(self.databuffer),byteorder="little")
-                if (self.sector*self.SECTORSIZE) >= self.get_size(self.disk):
+            self.incoming.append(data & 0xFF)
+            if len(self.incoming) == 4:
+                self.sector = int.from_bytes(self.incoming,byteorder="little")
+                if (self.sector*self.SECTORSIZE) >= self.size:
                     self.error = "SECTOR_ID_TOO_LARGE"
                 self.command = ""
-                self.databuffer = deque()
\ No newline at end of file
+                self.incoming = bytearray()
+        elif self.command == "SET_COUNT":
+            self.incoming.append(data & 0xFF)
+            if len(self.incoming) == 4:
+                self.count = int.from_bytes(self.incoming,byteorder="little")
+                self.command = ""
+                self.incoming = bytearray()
+        elif self.command == "SET_VECTOR":
+            self.incoming.append(data & 0xFF)
+            if len(self.incoming) == 2:
+                self.vector = int.from_bytes(self.incoming,byteorder="little") & VECTOR_MASK
+                self.command = ""
+                self.incoming = bytearray()
+
+# where boot maps the DMA controller's registers
+DMA_BASE = 0xFE00_0100
+
+class DMAController(Device):
+    "Moves blocks between the disk and ram in one host-side copy"
+    # register -> (offset from the first port, size in bytes), all little endian
+    REGISTERS = {"sector": (0x00, 4), "address": (0x04, 8), "length": (0x0C, 4), "vector": (0x12, 2)}
+
+    def __init__(self, ram:"Ram", disk:DiskIO, interrupt:object=None):
+        self.ram = ram
+        self.disk = disk
+        # raises a hardware interrupt, vector is the id raised when a transfer is done (0 for none)
+        self.interrupt = interrupt
+
+        self.sector = 0
+        self.address = 0
+        self.length = 0
+        self.vector = 0
+        self.error = 0
+        super().__init__()
+
+    def set_port(self, register_port):
+        ports = [None]*0x14
+        for name, (offset, size) in self.REGISTERS.items():
+            for idx in range(size):
+                ports[offset+idx] = self.field(name, idx, VECTOR_MASK if name == "vector" else None)
+
+        command = Port()
+        command.write = self.command
+        status = Port()
+        status.read = self.status
+        ports[0x10] = command
+        ports[0x11] = status
+
+        for port in ports:
+            register_port(port)
+
+    def snapshot(self):
+        return (self.sector, self.address, self.length, self.vector, self.error)
+
+    def restore(self, state):
+        self.sector, self.address, self.length, self.vector, self.error = state
+
+    def command(self, data:int):
+        # never copy under a disk command running on the worker thread
+        self.disk.wait()
+        start = self.sector*self.disk.SECTORSIZE
+        if data == 0x01: # disk to ram
+            view = self.disk.view(start, self.length)
+            if view is None:
+                self.error = 0x31
+            else:
+                try:
+                    self.ram.write_range(self.address, view)
+                finally:
+                    view.release()
+                self.error = 0
+        elif data == 0x02: # ram to disk
+            self.disk.save(start, self.ram.read_range(self.address, self.length))
+            self.error = 0
+        elif data == 0x30: # error ACK
+            self.error = 0
+            return
+        else:
+            self.error = 0x30
+        if self.vector and self.interrupt:
+            self.interrupt(self.vector)
+
+    def status(self):
+        "0 once the last transfer is done, 0x30 for an invalid command, 0x31 for reading past the end of the disk"
+        return self.error
+
+# where boot maps the timer's registers
+TIMER_BASE = 0xFE00_0200
+
+# hardware interrupt handlers return here, to an address in device space no port claims
+INTERRUPT_RETURN = 0xFE00_0FFC
+
+class Timer(Device):
+    "Raises an interrupt every period microseconds, or once, from a host thread that only runs while armed"
+    # register -> (offset from the first port, size in bytes), all little endian
+    REGISTERS = {"period": (0x00, 4), "vector": (0x04, 2), "ticks": (0x08, 4)}
+
+    def __init__(self, interrupt:object=None):
+        # raises a hardware interrupt, vector is the id raised on every tick (0 for none)
+        self.interrupt = interrupt
+
+        self.period = 0
+        self.vector = 0
+        # 0 stopped, 1 periodic, 2 one-shot
+        self.mode = 0
+        # ticks since the timer was armed
+        self.ticks = 0
+        # cleared when the interrupt is raised, ticks until the guest acknowledges it don't raise another
+        self.acked = True
+        # set to stop the thread of the current arming
+        self.stop = None
+        super().__init__()
+
+    def set_port(self, register_port):
+        ports = [Port() for _ in range(0x0C)]
+        for name, (offset, size) in self.REGISTERS.items():
+            for idx in range(size):
+                ports[offset+idx] = self.field(name, idx, VECTOR_MASK if name == "vector" else None)
+
+        control = Port()
+        control.write = self.control
+        control.read = self.status
+        ports[0x06] = control
+
+        for port in ports:
+            register_port(port)
+
+    def snapshot(self):
+        return (self.period, self.vector, self.mode, self.acked)
+
+    def restore(self, state):
+        period, vector, mode, acked = state
+        self.disarm()
+        self.period, self.vector = period, vector
+        if mode:
+            self.arm(mode)
+        self.acked = acked
+
+    def control(self, data:int):
+        "0x01 tick every period, 0x02 tick once after period, 0x30 acknowledge the interrupt, anything else stops the timer"
+        if data == 0x30:
+            self.acked = True
+        elif data in (0x01, 0x02) and self.period:
+            self.arm(data)
+        else:
+            self.disarm()
+
+    def status(self):
+        "1 while ticking periodically, 2 until a one-shot tick, 0 when stopped"
+        return self.mode
+
+    def arm(self, mode:int):
+        self.disarm()
+        self.mode = mode
+        self.ticks = 0
+        self.acked = True
+        self.stop = threading.Event()
+        thread = threading.Thread(target=self.tick, args=(self.stop, self.period / 1_000_000, mode == 1), daemon=True)
+        thread.start()
+
+    def close(self):
+        self.disarm()
+
+    def disarm(self):
+        if self.stop is not None:
+            self.stop.set()
+            self.stop = None
+        self.mode = 0
+
+    def tick(self, stop:threading.Event, period:float, periodic:bool):
+        deadline = time.monotonic()
+        while True:
+            deadline += period
+            if stop.wait(max(0, deadline - time.monotonic())):
+                return
+            # fell more than a period behind, skip the missed ticks instead of raising them all at once
+            deadline = max(deadline, time.monotonic() - period)
+            self.ticks = (self.ticks + 1) & 0xFFFF_FFFF
+            # a handler still running is not interrupted by the next tick
+            if self.vector and self.interrupt and self.acked:
+                self.acked = False
+                self.interrupt(self.vector)
+            if not periodic:
+                self.mode = 0
+                return
+
+if TYPE_CHECKING:
+    from memory import Ram
@@ -1,283 +1,347 @@
 from typing import Literal, TYPE_CHECKING
 
+# extend 8 bit to 16 bit
+def sign_extend_word(value):
+    value = value & 0xFF
+    return value + (value & 0x80)*0x1FE
+# extend 16 bit to 32 bit
+def sign_extend_double(value):
+    value = value & 0xFFFF
+    return value + (value & 0x8000)*0x1FFFE
+# extend 32 bit to 64 bit
+def sign_extend_quad(value):
+    value = value & 0xFFFF_FFFF
+    return value + (value & 0x8000_0000)*0x1FFFF_FFFE
+
+def sys_register_variant_get(variant:int):
+    read = bool(variant&0x8000 >> 7)
+    working_register = variant&0x6000 >> 5
+
+    return read, working_register
+
+def variable_mov_variant_get(variant:int):
+    source = (variant&0xC0) >> 6
+    dest   = (variant&0x30) >> 4
+    return source, dest
+
 class Executor:
     def __init__(self,emulator:"Emulator"):
         self.emulator = emulator
 
-    def execute(self, instruction:str, variant:int):
-        emulator = self.emulator
-        ram = emulator.ram
-        registers = emulator.registers
-        carry = emulator.carry
-        zero = emulator.zero
+        # opcode byte -> handler(variant, params), None for undefined opcodes
+        self.table:list = [None]*256
+        self.build_table()
 
-        get = emulator.get_param
+    def execute(self, opcode:int, variant:int, params:tuple=()):
+        self.table[opcode](variant, params)
 
-        # extend 8 bit to 16 bit
-        def sign_extend_word(value):
-            value = value & 0xFF
-            return value + (value & 0x80)*0x1FE
-        # extend 16 bit to 32 bit
-        def sign_extend_double(value):
-            value = value & 0xFFFF
-            return value + (value & 0x8000)*0x1FFFE
-        # extend 32 bit to 64 bit
-        def sign_extend_quad(value):
-            value = value & 0xFFFF_FFFF
-            return value + (value & 0x8000_0000)*0x1FFFF_FFFE
-        
-        def sys_register_variant_get():
-            read = bool(variant&0x8000 >> 7)
-            working_register = variant&0x6000 >> 5
+    def build_table(self):
+        "Bind every opcode in the definitions table to its handler, done once"
+        handlers = self.handlers()
+        for code, info in self.emulator.opcodes.OPCODES.items():
+            self.table[code] = handlers.get(info["mnemonic"])
 
-            return read, working_register
+    def handlers(self) -> dict[str,object]:
+        emulator = self.emulator
+        ram = emulator.ram
+        registers = emulator.registers
 
-        def variable_mov_variant_get():
-            source = (variant&0xC0) >> 6
-            dest   = (variant&0x30) >> 4
-            return source, dest
+        handlers = {}
 
-        if instruction in ["BP","IVIP","SP"]:
-            read, register = sys_register_variant_get()
-            match instruction:
+        # --- Special Register ---
+        def bp(variant, params):
+            read, register = sys_register_variant_get(variant)
+            if read:
+                registers[register] = ram.stack_start
+            else:
+                ram.stack_start = registers[register]
+        def ivip(variant, params):
+            read, register = sys_register_variant_get(variant)
+            if read:
+                registers[register] = emulator.begininst
+            else:
+                ram.int_start = registers[register]
+        def sp(variant, params):
+            read, register = sys_register_variant_get(variant)
+            if read:
+                registers[register] = ram.stack_pos
+            else:
+                ram.stack_pos = registers[register]
+        handlers["BP"] = bp
+        handlers["IVIP"] = ivip
+        handlers["SP"] = sp
 
-                case "BP":
-                    if read:
-                        registers[register] = ram.stack_start
-                    else:
-                        ram.stack_start = registers[register]
-                case "IVIP":
-                    if read:
-                        registers[register] = emulator.begininst
-                    else:
-                        ram.int_start = registers[register]
-                case "SP":
-                    if read:
-                        registers[register] = ram.stack_pos
-                    else:
-                        ram.stack_pos = registers[register]
-        elif instruction.startswith("STV"):
+        # --- Variable load/store ---
+        def variable_store(store):
             # int source
             # int* dest
-            source, dest = variable_mov_variant_get()
-            offset = 0
-            if dest == 3:
-                dest = ram.stack_start+offset
-            else:
-                dest = registers[dest]+offset
-            if source == 3:
-                emulator.int_fault(0x101)
-            match instruction:
-                case "STV" : ram.store(dest,registers[source])
-                case "STVD": ram.store_double(dest,registers[source])
-                case "STVQ": ram.store_quad(dest,registers[source])
-                case "STVW": ram.store_word(dest,registers[source])
-        elif instruction.startswith("LDV"):
+            def handler(variant, params):
+                source, dest = variable_mov_variant_get(variant)
+                if dest == 3:
+                    dest = ram.stack_start
+                else:
+                    dest = registers[dest]
+                if source == 3:
+                    emulator.int_fault(0x101)
+                store(dest,registers[source])
+            return handler
+        def variable_load(load):
             # int* source
             # int dest
-            source, dest = variable_mov_variant_get()
-            offset = 0
-            if source == 3:
-                source = ram.stack_start+offset
-            else:
-                source = registers[source]+offset
-            if dest == 3:
-                emulator.int_fault(0x101)
-            match instruction:
-                case "LDV" : registers[dest] = ram.load(source+offset)
-                case "LDVD": registers[dest] = ram.load_double(source+offset)
-                case "LDVQ": registers[dest] = ram.load_quad(source+offset)
-                case "LDVW": registers[dest] = ram.load_word(source+offset)
-        elif instruction.startswith("LD") or instruction.startswith("ST") or instruction.startswith("MOV"):
-            match instruction:
-                case "LDA": registers[0] = ram.load(get())
-                case "LDX": registers[1] = ram.load(get())
-                case "LDY": registers[2] = ram.load(get())
-
-                case "STA": ram.store(get(),registers[0])
-                case "STX": ram.store(get(),registers[1])
-                case "STY": ram.store(get(),registers[2])
-
-                case "MOV": ram.store(get(),ram.load(get()))
-
-                case "LDAD": registers[0] = ram.load_double(get())
-                case "LDXD": registers[1] = ram.load_double(get())
-                case "LDYD": registers[2] = ram.load_double(get())
-
-                case "STAD": ram.store_double(get(),registers[0])
-                case "STXD": ram.store_double(get(),registers[1])
-                case "STYD": ram.store_double(get(),registers[2])
-
-                case "MOVD": ram.store_double(get(),ram.load_double(get()))
-
-                case "LDAQ": registers[0] = ram.load_quad(get())
-                case "LDXQ": registers[1] = ram.load_quad(get())
-                case "LDYQ": registers[2] = ram.load_quad(get())
-
-                case "STAQ": ram.store_quad(get(),registers[0])
-                case "STXQ": ram.store_quad(get(),registers[1])
-                case "STYQ": ram.store_quad(get(),registers[2])
-
-                case "MOVQ": ram.store_quad(get(),ram.load_quad(get()))
-
-                case "LDAW": registers[0] = ram.load_word(get())
-                case "LDXW": registers[1] = ram.load_word(get())
-                case "LDYW": registers[2] = ram.load_word(get())
-
-                case "STAW": ram.store_word(get(),registers[0])
-                case "STXW": ram.store_word(get(),registers[1])
-                case "STYW": ram.store_word(get(),registers[2])
-
-                case "MOVW": ram.store_word(get(),ram.load_word(get()))
-
-                case "LDAI": registers[0] = get()
-                case "LDXI": registers[1] = get()
-                case "LDYI": registers[2] = get()
-        else:
-            match instruction:
-                case "HALT": emulator.running = False; emulator.halt_type = 1
-                case "HALTZ": emulator.running = False; emulator.halt_type = 2
-                case "ADD":
-                    registers[0] = registers[1] + registers[2]
-                    emulator.correct_register()
-                case "SUB":
-                    registers[0] = registers[1] - registers[2]
-                    emulator.correct_register()
-                case "MUL":
-                    registers[0] = registers[1] * registers[2]
-                    emulator.correct_register()
-                case "DIV":
-                    registers[0] = registers[1] // registers[2]
-                    emulator.correct_register()
-                case "MOD":
-                    registers[0] = registers[1] % registers[2]
-                    emulator.correct_register()
-                case "SXTW": registers[0] = sign_extend_word(registers[0])
-                case "SXTD": registers[0] = sign_extend_double(registers[0])
-                case "SXTQ": registers[0] = sign_extend_quad(registers[0])
-
-                case "AND": registers[0] = registers[1] & registers[2]
-                case "OR": registers[0] = registers[1] | registers[2]
-                case "XOR": registers[0] = registers[1] ^ registers[2]
-                case "NOT": registers[0] = ~registers[1]
-                case "SHL":
-                    registers[0] = registers[1] << registers[2]
-                    emulator.correct_register()
-                case "SHR":
-                    registers[0] = registers[1] >> registers[2]
-                    emulator.correct_register()
-                case "SHLB": registers[0] = registers[1] << 8
-                case "SHRB": registers[0] = registers[1] >> 8
-
-                case "CMPA": emulator.compare(registers[0],get())
-                case "CMPX": emulator.compare(registers[1],get())
-                case "CMPY": emulator.compare(registers[2],get())
-
-                case "CPAX": emulator.compare(registers[0],registers[1])
-                case "CPAY": emulator.compare(registers[0],registers[2])
-                case "CPXY": emulator.compare(registers[1],registers[2])
-                case "CPXA": emulator.compare(registers[1],registers[0])
-                case "CPYA": emulator.compare(registers[2],registers[0])
-                case "CPYX": emulator.compare(registers[2],registers[1])
-
-                case "AJMP":
-                    target = get()
-                    emulator.counter = target
-                case "AJZ":
-                    target = get()
-                    if zero: emulator.counter = target
-                case "AJNZ":
-                    target = get()
-                    if not zero: emulator.counter = target
-                case "AJC":
-                    target = get()
-                    if carry: emulator.counter = target
-                case "AJNC":
-                    target = get()
-                    if (not carry): emulator.counter = target
-
-                case "RET": emulator.counter = ram.pop_double()
-                case "ACALL":
-                    target = get()
-                    ram.push_double(emulator.counter); emulator.counter = target
-                case "ABZ":
-                    target = get()
-                    if zero: ram.push_double(emulator.counter); emulator.counter = target
-                case "ABNZ":
-                    target = get()
-                    if not zero: ram.push_double(emulator.counter); emulator.counter = target
-                case "ABC":
-                    target = get()
-                    if carry: ram.push_double(emulator.counter); emulator.counter = target
-                case "ABNC":
-                    target = get()
-                    if not carry: ram.push_double(emulator.counter); emulator.counter = target
-
-                case "JMP": emulator.counter = emulator.begininst + get(signed=True)
-                case "JZ":
-                    target = get(signed=True)
-                    if zero: emulator.counter = emulator.begininst + target
-                case "JNZ":
-                    target = get(signed=True)
-                    if not zero: emulator.counter = emulator.begininst + target
-                case "JC":
-                    target = get(signed=True)
-                    if carry: emulator.counter = emulator.begininst + target
-                case "JNC":
-                    target = get(signed=True)
-                    if not carry: emulator.counter = emulator.begininst + target
-
-                case "CALL":
-                    target = get(signed=True)
-                    ram.push_double(emulator.counter); emulator.counter = emulator.begininst + target
-                case "BZ":
-                    target = get(signed=True)
-                    if zero: ram.push_double(emulator.counter); emulator.counter = emulator.begininst + target
-                case "BNZ":
-                    target = get(signed=True)
-                    if not zero: ram.push_double(emulator.counter); emulator.counter = emulator.begininst + target
-                case "BC":
-                    target = get(signed=True)
-                    if carry: ram.push_double(emulator.counter); emulator.counter = emulator.begininst + target
-                case "BNC":
-                    target = get(signed=True)
-                    if (not carry): ram.push_double(emulator.counter); emulator.counter = emulator.begininst + target
-
-                case "JMPV": emulator.counter = registers[0]
-                case "CALLV": ram.push_double(emulator.counter); emulator.counter = registers[0]
-
-                case "MVAX": registers[1] = registers[0]
-                case "MVAY": registers[2] = registers[0]
-                case "MVXA": registers[0] = registers[1]
-                case "MVXY": registers[2] = registers[1]
-                case "MVYA": registers[0] = registers[2]
-                case "MVYX": registers[1] = registers[2]
-
-                case "PUSHA": ram.push_double(registers[0])
-                case "POPA": registers[0] = ram.pop_double()
-                case "PUSHX": ram.push_double(registers[1])
-                case "POPX": registers[1] = ram.pop_double()
-                case "PUSHY": ram.push_double(registers[2])
-                case "POPY": registers[2] = ram.pop_double()
-                case "PUSHR":
-                    ram.push_double(registers[0])
-                    ram.push_double(registers[1])
-                    ram.push_double(registers[2])
-                case "POPR":
-                    registers[2] = ram.pop_double()
-                    registers[1] = ram.pop_double()
-                    registers[0] = ram.pop_double()
-
-                case "INT":
-                    address = ram.find_int(get())
-                    ram.push_double(emulator.counter)
-                    emulator.counter = address
-
-                case "INTR":
-                    ram.register_int(get(),get())
-
-                case "REDC": emulator.blocksize = max(1, emulator.blocksize * 2)
-                case "EXTN": emulator.blocksize = min(4, emulator.blocksize * 2)
+            def handler(variant, params):
+                source, dest = variable_mov_variant_get(variant)
+                if source == 3:
+                    source = ram.stack_start
+                else:
+                    source = registers[source]
+                if dest == 3:
+                    emulator.int_fault(0x101)
+                registers[dest] = load(source)
+            return handler
+
+        # --- RAM load/store ---
+        def load(register, load):
+            def handler(variant, params):
+                registers[register] = load(params[0])
+            return handler
+        def store(register, store):
+            def handler(variant, params):
+                store(params[0],registers[register])
+            return handler
+        def move(store, load):
+            def handler(variant, params):
+                store(params[0],load(params[1]))
+            return handler
+
+        for suffix, loader, storer in (
+            ("",  ram.load,        ram.store),
+            ("W", ram.load_word,   ram.store_word),
+            ("D", ram.load_double, ram.store_double),
+            ("Q", ram.load_quad,   ram.store_quad),
+        ):
+            for register, name in enumerate("AXY"):
+                handlers[f"LD{name}{suffix}"] = load(register, loader)
+                handlers[f"ST{name}{suffix}"] = store(register, storer)
+            handlers[f"MOV{suffix}"] = move(storer, loader)
+            handlers[f"LDV{suffix}"] = variable_load(loader)
+            handlers[f"STV{suffix}"] = variable_store(storer)
+
+        def load_immediate(register):
+            def handler(variant, params):
+                registers[register] = params[0]
+            return handler
+        for register, name in enumerate("AXY"):
+            handlers[f"LD{name}I"] = load_immediate(register)
+
+        # --- Halt ---
+        def halt(variant, params):
+            emulator.running = False; emulator.halt_type = 1
+        def haltz(variant, params):
+            emulator.running = False; emulator.halt_type = 2
+        handlers["HALT"] = halt
+        handlers["HALTZ"] = haltz
+
+        # --- Arithmetic ---
+        def add(variant, params):
+            registers[0] = registers[1] + registers[2]
+            emulator.correct_register()
+        def sub(variant, params):
+            registers[0] = registers[1] - registers[2]
+            emulator.correct_register()
+        def mul(variant, params):
+            registers[0] = registers[1] * registers[2]
+            emulator.correct_register()
+        def div(variant, params):
+            registers[0] = registers[1] // registers[2]
+            emulator.correct_register()
+        def mod(variant, params):
+            registers[0] = registers[1] % registers[2]
+            emulator.correct_register()
+        def sxtw(variant, params): registers[0] = sign_extend_word(registers[0])
+        def sxtd(variant, params): registers[0] = sign_extend_double(registers[0])
+        def sxtq(variant, params): registers[0] = sign_extend_quad(registers[0])
+        handlers["ADD"] = add
+        handlers["SUB"] = sub
+        handlers["MUL"] = mul
+        handlers["DIV"] = div
+        handlers["MOD"] = mod
+        handlers["SXTW"] = sxtw
+        handlers["SXTD"] = sxtd
+        handlers["SXTQ"] = sxtq
+
+        # --- Bitwise Logic ---
+        def and_(variant, params): registers[0] = registers[1] & registers[2]
+        def or_(variant, params): registers[0] = registers[1] | registers[2]
+        def xor(variant, params): registers[0] = registers[1] ^ registers[2]
+        def not_(variant, params): registers[0] = ~registers[1]
+        def shl(variant, params):
+            registers[0] = registers[1] << registers[2]
+            emulator.correct_register()
+        def shr(variant, params):
+            registers[0] = registers[1] >> registers[2]
+            emulator.correct_register()
+        def shlb(variant, params): registers[0] = registers[1] << 8
+        def shrb(variant, params): registers[0] = registers[1] >> 8
+        handlers["AND"] = and_
+        handlers["OR"] = or_
+        handlers["XOR"] = xor
+        handlers["NOT"] = not_
+        handlers["SHL"] = shl
+        handlers["SHR"] = shr
+        handlers["SHLB"] = shlb
+        handlers["SHRB"] = shrb
+
+        # --- Comparison ---
+        def compare_immediate(register):
+            def handler(variant, params):
+                emulator.compare(registers[register],params[0])
+            return handler
+        def compare_registers(first, second):
+            def handler(variant, params):
+                emulator.compare(registers[first],registers[second])
+            return handler
+        for register, name in enumerate("AXY"):
+            handlers[f"CMP{name}"] = compare_immediate(register)
+            for other, other_name in enumerate("AXY"):
+                if other != register:
+                    handlers[f"CM{name}{other_name}"] = compare_registers(register, other)
+
+        # --- Absolute Control Flow ---
+        def ajmp(variant, params):
+            emulator.counter = params[0]
+        def ajz(variant, params):
+            if emulator.zero: emulator.counter = params[0]
+        def ajnz(variant, params):
+            if not emulator.zero: emulator.counter = params[0]
+        def ajc(variant, params):
+            if emulator.carry: emulator.counter = params[0]
+        def ajnc(variant, params):
+            if not emulator.carry: emulator.counter = params[0]
+        handlers["AJMP"] = ajmp
+        handlers["AJZ"] = ajz
+        handlers["AJNZ"] = ajnz
+        handlers["AJC"] = ajc
+        handlers["AJNC"] = ajnc
+
+        # --- Absolute Function Flow ---
+        def ret(variant, params):
+            emulator.counter = ram.pop_address()
+        def acall(variant, params):
+            ram.push_address(emulator.counter); emulator.counter = params[0]
+        def abz(variant, params):
+            if emulator.zero: ram.push_address(emulator.counter); emulator.counter = params[0]
+        def abnz(variant, params):
+            if not emulator.zero: ram.push_address(emulator.counter); emulator.counter = params[0]
+        def abc(variant, params):
+            if emulator.carry: ram.push_address(emulator.counter); emulator.counter = params[0]
+        def abnc(variant, params):
+            if not emulator.carry: ram.push_address(emulator.counter); emulator.counter = params[0]
+        handlers["RET"] = ret
+        handlers["ACALL"] = acall
+        handlers["ABZ"] = abz
+        handlers["ABNZ"] = abnz
+        handlers["ABC"] = abc
+        handlers["ABNC"] = abnc
+
+        # --- Relative Control Flow ---
+        def jmp(variant, params):
+            emulator.counter = emulator.begininst + params[0]
+        def jz(variant, params):
+            if emulator.zero: emulator.counter = emulator.begininst + params[0]
+        def jnz(variant, params):
+            if not emulator.zero: emulator.counter = emulator.begininst + params[0]
+        def jc(variant, params):
+            if emulator.carry: emulator.counter = emulator.begininst + params[0]
+        def jnc(variant, params):
+            if not emulator.carry: emulator.counter = emulator.begininst + params[0]
+        handlers["JMP"] = jmp
+        handlers["JZ"] = jz
+        handlers["JNZ"] = jnz
+        handlers["JC"] = jc
+        handlers["JNC"] = jnc
+
+        # --- Relative Function Flow ---
+        def call(variant, params):
+            ram.push_address(emulator.counter); emulator.counter = emulator.begininst + params[0]
+        def bz(variant, params):
+            if emulator.zero: ram.push_address(emulator.counter); emulator.counter = emulator.begininst + params[0]
+        def bnz(variant, params):
+            if not emulator.zero: ram.push_address(emulator.counter); emulator.counter = emulator.begininst + params[0]
+        def bc(variant, params):
+            if emulator.carry: ram.push_address(emulator.counter); emulator.counter = emulator.begininst + params[0]
+        def bnc(variant, params):
+            if not emulator.carry: ram.push_address(emulator.counter); emulator.counter = emulator.begininst + params[0]
+        handlers["CALL"] = call
+        handlers["BZ"] = bz
+        handlers["BNZ"] = bnz
+        handlers["BC"] = bc
+        handlers["BNC"] = bnc
+
+        # --- Indirect Flow Control ---
+        def jmpv(variant, params):
+            emulator.counter = registers[0]
+        def callv(variant, params):
+            ram.push_address(emulator.counter); emulator.counter = registers[0]
+        handlers["JMPV"] = jmpv
+        handlers["CALLV"] = callv
+
+        # --- Register-register ---
+        def register_move(source, dest):
+            def handler(variant, params):
+                registers[dest] = registers[source]
+            return handler
+        for source, source_name in enumerate("AXY"):
+            for dest, dest_name in enumerate("AXY"):
+                if source != dest:
+                    handlers[f"MV{source_name}{dest_name}"] = register_move(source, dest)
+
+        # --- Stack ---
+        def push(register):
+            def handler(variant, params):
+                ram.push_double(registers[register])
+            return handler
+        def pop(register):
+            def handler(variant, params):
+                registers[register] = ram.pop_double()
+            return handler
+        for register, name in enumerate("AXY"):
+            handlers[f"PUSH{name}"] = push(register)
+            handlers[f"POP{name}"] = pop(register)
+        def pushr(variant, params):
+            ram.push_double(registers[0])
+            ram.push_double(registers[1])
+            ram.push_double(registers[2])
+        def popr(variant, params):
+            registers[2] = ram.pop_double()
+            registers[1] = ram.pop_double()
+            registers[0] = ram.pop_double()
+        handlers["PUSHR"] = pushr
+        handlers["POPR"] = popr
+
+        # --- Interrupt ---
+        def int_(variant, params):
+            address = ram.find_int(params[0])
+            ram.push_address(emulator.counter)
+            emulator.counter = address
+        def intr(variant, params):
+            ram.register_int(params[0],params[1])
+        handlers["INT"] = int_
+        handlers["INTR"] = intr
+
+        # --- Block size ---
+        # operand sizes change, so everything decoded so far is stale
+        def redc(variant, params):
+            emulator.blocksize = max(1, emulator.blocksize * 2)
+            ram.set_blocksize(emulator.blocksize)
+            emulator.decoder.flush()
+        def extn(variant, params):
+            emulator.blocksize = min(4, emulator.blocksize * 2)
+            ram.set_blocksize(emulator.blocksize)
+            emulator.decoder.flush()
+        handlers["REDC"] = redc
+        handlers["EXTN"] = extn
+
+        return handlers
 
 if TYPE_CHECKING:
-    from main import Emulator
\ No newline at end of file
+    from main import Emulator
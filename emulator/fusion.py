@@ -0,0 +1,260 @@
+from typing import TYPE_CHECKING
+
+CONDITIONS = {"Z","NZ","C","NC"}
+
+class Fusion:
+    "Joins common instruction sequences into a single decoded entry"
+    def __init__(self, emulator:"Emulator"):
+        self.emulator = emulator
+        self.decoder = emulator.decoder
+        self.opcodes = emulator.opcodes.OPCODES
+
+        # fusion name -> [times run to the end, instructions covered]
+        self.counts:dict[str,list[int]] = {}
+        # instructions fused entries ran beyond the one dispatch each took, counted as each one finishes.
+        # the dispatch pays for the last instruction an entry got to, whether it finished or faulted
+        self.ran = [0]
+        # most instructions a single fused entry covers
+        self.longest = 4
+
+    def lookahead(self, pc:int, count:int):
+        "Decode up to `count` instructions from pc as (mnemonic, pc, params, end)"
+        # widest instruction there is, two operands at the current block size
+        span = 2 + 4*self.emulator.blocksize
+        device_pages = self.emulator.ram.device_pages
+        mask = self.emulator.ram.mask
+        result = []
+        for _ in range(count):
+            if ((pc & mask) >> 12) in device_pages or (((pc+span-1) & mask) >> 12) in device_pages:
+                break
+            opcode, variant, params, length = self.decoder.read(pc)
+            info = self.opcodes.get(opcode)
+            if info is None:
+                break
+            result.append((info["mnemonic"], pc, params, pc+length))
+            pc += length
+        return result
+
+    def fuse(self, pc:int, entry:tuple, opcode:int):
+        "A fused entry for the sequence starting at pc, None if nothing matches"
+        info = self.opcodes.get(opcode)
+        if info is None:
+            return None
+        name = info["mnemonic"]
+
+        if name.startswith(("LD","CM")):
+            return self.compare_branch(pc)
+        if name == "POPR":
+            return self.popr_ret(pc)
+        if name == "PUSHR":
+            return self.pushr_call(pc)
+        if name.startswith("MV"):
+            return self.move_store(pc)
+        return None
+
+    def counter(self, name:str, covered:int):
+        if name not in self.counts:
+            self.counts[name] = [0, covered]
+        return self.counts[name]
+
+    def compare_branch(self, pc:int):
+        "Up to two register loads, a compare, then a conditional jump"
+        sequence = self.lookahead(pc, 4)
+        setup = []
+        for mnemonic, start, params, end in sequence:
+            if len(setup) == 2:
+                break
+            if len(mnemonic) == 3 and mnemonic[:2] == "LD" and mnemonic[2] in "AXY":
+                setup.append(("AXY".index(mnemonic[2]), params[0], None, start, end))
+            elif len(mnemonic) == 4 and mnemonic[:2] == "LD" and mnemonic[2] in "AXY" and mnemonic[3] == "I":
+                setup.append(("AXY".index(mnemonic[2]), None, params[0], start, end))
+            else:
+                break
+
+        rest = sequence[len(setup):]
+        if len(rest) < 2:
+            return None
+        (compare, _, compare_params, _), (jump, jump_start, jump_params, end) = rest[:2]
+
+        if len(compare) == 4 and compare[:3] == "CMP" and compare[3] in "AXY":
+            first, second, immediate = "AXY".index(compare[3]), None, compare_params[0]
+        elif len(compare) == 4 and compare[:2] == "CM" and compare[2] in "AXY" and compare[3] in "AXY":
+            first, second, immediate = "AXY".index(compare[2]), "AXY".index(compare[3]), None
+        else:
+            return None
+
+        if jump[:2] == "AJ" and jump[2:] in CONDITIONS:
+            condition, target = jump[2:], jump_params[0]
+        elif jump[0] == "J" and jump[1:] in CONDITIONS:
+            condition, target = jump[1:], jump_start + jump_params[0]
+        else:
+            return None
+        flag = "zero" if condition[-1] == "Z" else "carry"
+        negate = condition[0] == "N"
+
+        name = "+".join(item[0] for item in sequence[:len(setup)+2])
+        counts = self.counter(name, len(setup)+2)
+
+        emulator = self.emulator
+        registers = emulator.registers
+        load = emulator.ram.load
+        ran = self.ran
+
+        def handler(variant, params):
+            for register, address, immediate_value, start, after in setup:
+                if address is None:
+                    registers[register] = immediate_value
+                else:
+                    # where it would be unfused, should the load fault or raise
+                    emulator.begininst = start
+                    emulator.counter = after
+                    registers[register] = load(address)
+                ran[0] += 1
+
+            value = registers[first]
+            other = immediate if second is None else registers[second]
+            emulator.carry = value < other
+            emulator.zero = value == other
+            ran[0] += 1
+
+            if (emulator.zero if flag == "zero" else emulator.carry) != negate:
+                emulator.counter = target
+            else:
+                emulator.counter = end
+            counts[0] += 1
+
+        return (handler, 0, (), end - pc)
+
+    def popr_ret(self, pc:int):
+        "Restore every register and return, the tail of most BIOS routines"
+        sequence = self.lookahead(pc, 2)
+        if [item[0] for item in sequence] != ["POPR","RET"]:
+            return None
+        after_popr = sequence[0][3]
+        end = sequence[1][3]
+        counts = self.counter("POPR+RET", 2)
+
+        emulator = self.emulator
+        registers = emulator.registers
+        pop_double = emulator.ram.pop_double
+        pop_address = emulator.ram.pop_address
+        ran = self.ran
+
+        def handler(variant, params):
+            emulator.counter = after_popr
+            registers[2] = pop_double()
+            registers[1] = pop_double()
+            registers[0] = pop_double()
+            ran[0] += 1
+            # a fault in the return's own pop returns past it, like it would unfused
+            emulator.begininst = after_popr
+            emulator.counter = end
+            emulator.counter = pop_address()
+            counts[0] += 1
+
+        return (handler, 0, (), end - pc)
+
+    def pushr_call(self, pc:int):
+        "Save every register then call, the head of most BIOS routines"
+        sequence = self.lookahead(pc, 2)
+        if len(sequence) < 2 or sequence[0][0] != "PUSHR" or sequence[1][0] not in ("CALL","ACALL"):
+            return None
+        _, call_start, call_params, end = sequence[1]
+        after_pushr = call_start
+        target = call_params[0] if sequence[1][0] == "ACALL" else call_start + call_params[0]
+        counts = self.counter("PUSHR+" + sequence[1][0], 2)
+
+        emulator = self.emulator
+        registers = emulator.registers
+        push_double = emulator.ram.push_double
+        push_address = emulator.ram.push_address
+        cache = self.decoder.cache
+        ran = self.ran
+
+        def handler(variant, params):
+            emulator.counter = after_pushr
+            push_double(registers[0])
+            push_double(registers[1])
+            push_double(registers[2])
+            # the stack ran over this code, let the call be decoded again
+            if pc not in cache:
+                return
+            ran[0] += 1
+            # a fault in the call's own push returns past the call, like it would unfused
+            emulator.begininst = call_start
+            emulator.counter = end
+            push_address(end)
+            emulator.counter = target
+            counts[0] += 1
+
+        return (handler, 0, (), end - pc)
+
+    def move_store(self, pc:int):
+        "Register move, store to a fixed address, then optionally a byte shift"
+        sequence = self.lookahead(pc, 3)
+        if len(sequence) < 2:
+            return None
+        (move, _, _, after_move), (store, store_start, store_params, after_store) = sequence[:2]
+        if len(move) != 4 or move[2] not in "AXY" or move[3] not in "AXY" or move[2] == move[3]:
+            return None
+        source, dest = "AXY".index(move[2]), "AXY".index(move[3])
+
+        sizes = {"": 1, "W": 2, "D": 4, "Q": 8}
+        if not (store[:2] == "ST" and store[2:3] == move[3] and store[3:] in sizes):
+            return None
+        size = sizes[store[3:]]
+        store_function = {
+            1: self.emulator.ram.store, 2: self.emulator.ram.store_word,
+            4: self.emulator.ram.store_double, 8: self.emulator.ram.store_quad,
+        }[size]
+        address = store_params[0]
+
+        shift = None
+        end = after_store
+        if len(sequence) == 3 and sequence[2][0] in ("SHLB","SHRB"):
+            shift = sequence[2][0]
+            end = sequence[2][3]
+
+        # a store into the sequence itself has to be seen by what follows it
+        if address < end and pc < address + size:
+            return None
+
+        name = "+".join(item[0] for item in sequence[:3 if shift else 2])
+        counts = self.counter(name, 3 if shift else 2)
+
+        emulator = self.emulator
+        registers = emulator.registers
+        ran = self.ran
+
+        def handler(variant, params):
+            registers[dest] = registers[source]
+            ran[0] += 1
+            emulator.begininst = store_start
+            emulator.counter = after_store
+            store_function(address, registers[dest])
+            if shift:
+                # a device raised an interrupt, which goes before the shift like it would unfused
+                if not emulator.running:
+                    return
+                ran[0] += 1
+                emulator.counter = end
+                if shift == "SHRB":
+                    registers[0] = registers[1] >> 8
+                else:
+                    registers[0] = registers[1] << 8
+            counts[0] += 1
+
+        return (handler, 0, (), end - pc)
+
+    def saved(self) -> int:
+        "Instructions run by fused entries beyond the one dispatch each of them took"
+        return self.ran[0]
+
+    def report(self) -> list[tuple[str,int,int]]:
+        "(fusion, times run, dispatches saved) for every fusion that ran, most saved first"
+        rows = [(name, ran, ran*(covered-1)) for name, (ran, covered) in self.counts.items() if ran]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+if TYPE_CHECKING:
+    from main import Emulator
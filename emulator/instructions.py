@@ -1,12 +1,10 @@
 from typing import Literal, TYPE_CHECKING
 import __future__
-import executor
 
 class Opcodes:
     def __init__(self, emulator:"em.Emulator"):
         self.emulator = emulator
         self.OPCODES:dict[(str,dict[Literal["mnemonic","opcode","size","operands","desc"]])] = {}
-        self.executor = executor.Executor(self.emulator)
         self.definitions()
 
     # Helper function to insert opcodes into the list
@@ -4,7 +4,11 @@ from device import *
 import argparse
 import os
 from executor import Executor
+from decoder import Decoder
+from translator import Translator
+from fusion import Fusion
 import time
+import itertools
 import re
 from color import *
 
@@ -19,10 +23,11 @@ class Emulator:
     def __init__(self):
         self.registers = [0,0,0]
 
+        self.ram = Ram()
+
         self.opcodes = Opcodes(self)
         self.executor = Executor(self)
-
-        self.ram = Ram()
+        self.decoder = Decoder(self)
 
         self.counter = 0
         self.begininst = 0
@@ -36,13 +41,41 @@ class Emulator:
         self.crash_on_unknown = True
 
         self.time = []
+        self.do_time = False
 
         self.trace = []
         self.do_trace = False
         self.block_recursion = False
         self.recursion_limit = 10000
+        self.recursion_table = {}
+        # Set to true if debugging the BIOS
+        self.tracing = False
 
         self.params = []
+
+        # run compiled basic blocks instead of single instructions
+        self.translate = False
+        self.translator = None
+
+        # run common instruction sequences as single operations
+        self.fuse = True
+
+        # instructions run over every run(), and how many run() runs before it looks at the clock and the console again
+        self.executed = 0
+        self.slice = 1024
+
+        # hardware interrupts raised and not yet taken
+        self.pending:list[int] = []
+
+        # console output goes to stdout as raw bytes instead of characters
+        self.raw_console = False
+        # serve the console on this Unix socket path or (host, port) instead of stdin and stdout
+        self.console_address = None
+
+        self.console = None
+        self.diskio = None
+        self.dma = None
+        self.timer = None
     
     # Ensure register A is within bounds
     def correct_register(self):
@@ -75,137 +108,435 @@ class Emulator:
     def int_fault(self,id):
             target = self.ram.find_int(id)
             if target:
-                self.ram.push_double(self.counter)
+                try:
+                    self.ram.push_address(self.counter)
+                except pageFault:
+                    raise executionError(f"Page fault while entering the handler for interrupt x{id:X} (resident page limit of {self.ram.max_pages} reached)")
                 self.counter = target
+            elif id == 0x102:
+                raise executionError(f"Resident page limit of {self.ram.max_pages} reached at x{self.begininst:X} with no page fault handler")
             elif target != 0x102:
                 self.int_fault(0x100)
     
-    def fetch(self):
-        value = self.ram.load(self.counter)
-        self.counter += 1
-        return value
-    
-    def get_param(self,size:int=None,signed=False):
-        "size in words, defaults to address size"
-        if size is None:
-            size = self.blocksize
-        val = 0
-
-        for idx in range(size):
-            val |= (self.fetch() | (self.fetch() << 8)) << (idx*16)
-
-        if signed:
-            sign_bit = 1 << (size * 16 - 1)
-            if val & sign_bit:
-                val = val - (1 << (self.blocksize * 16))
-            val = val
-
-        self.params.append(val)
-        return val
-
 
-    def main(self, disk:str, stdin):
+    def boot(self, disk:"str|bytes", stdin:str=None, bios:bytes=None, output:bytearray=None, overlay:bool=False, console_input:"int|object"=None):
+        "Flash the BIOS and attach the devices. disk is a path or the image itself, bios defaults to bios.bin, console output goes to output if given, overlay keeps disk writes off the image file, console_input is read instead of stdin when there is no stdin string"
 
         # Flash Bios
-        bios = bytes()
-        try:
-            with open(f"{os.path.dirname(__file__)}/bios.bin","rb") as biosfile:
-                bios = biosfile.read()
-        except FileNotFoundError:
-            raise executionError("BIOS binary not found")
+        if bios is None:
+            try:
+                with open(f"{os.path.dirname(__file__)}/bios.bin","rb") as biosfile:
+                    bios = biosfile.read()
+            except FileNotFoundError:
+                raise executionError("BIOS binary not found")
 
-        for idx, value in enumerate(bios):
-            self.ram.store(idx+0xFFFF_0000, value) # offset 4294901760
+        self.ram.write_range(0xFFFF_0000, bios) # offset 4294901760
 
         self.counter = 0xFFFF_0000
 
-        # Set to true if debugging the BIOS
-        tracing = False
-
-        recursion_table = {}
-
         # register console
-        console = SerialConsole(stdin)
-        self.ram.register_device(console)
+        if self.console_address is not None:
+            self.console = SocketConsole(self.console_address)
+        else:
+            self.console = SerialConsole(stdin, output, self.raw_console, console_input)
+        self.ram.register_device(self.console)
 
         # register disk controller
         try:
-            diskio = DiskIO(disk)
+            self.diskio = DiskIO(disk, overlay, self.interrupt)
         except FileNotFoundError:
             raise executionError(f"Disk image \"{disk}\" not found")
-        self.ram.register_device(diskio)
+        self.ram.register_device(self.diskio)
+
+        # register DMA controller
+        self.dma = DMAController(self.ram, self.diskio, self.interrupt)
+        self.ram.register_device(self.dma, DMA_BASE)
+
+        # register timer
+        self.timer = Timer(self.interrupt)
+        self.ram.register_device(self.timer, TIMER_BASE)
+
+    def run(self, instructions:int=None, nanoseconds:int=None) -> int:
+        "Run until halted or out of budget, returns the instructions run. instructions stops at exactly that many"
+        deadline = None if nanoseconds is None else time.perf_counter_ns() + nanoseconds
+        # a guest polling the console doesn't get to wait past the budget either
+        if self.console is not None:
+            self.console.deadline = None if nanoseconds is None else time.monotonic() + nanoseconds / 1e9
+        done = 0
+        # a slice at a time, in between the console takes in input and writes out output held too long
+        while self.running or (self.pending and self.halt_type is None):
+            if deadline is not None and time.perf_counter_ns() >= deadline:
+                break
+            limit = self.slice if instructions is None else min(self.slice, instructions - done)
+            if limit <= 0:
+                break
+            done += self.dispatch(limit)
+        return done
+
+    def dispatch(self, limit:int=None) -> int:
+        # anything that looks at single instructions needs the instrumented loop
+        if self.do_time or self.do_trace or self.block_recursion:
+            loop = self.run_instrumented
+        elif self.translate:
+            if self.translator is None:
+                self.translator = Translator(self)
+            loop = self.run_blocks
+        else:
+            loop = self.run_plain
+
+        fuse = self.fuse and loop == self.run_plain
+        if fuse and self.decoder.fusion is None:
+            self.decoder.fusion = Fusion(self)
+        elif not fuse and self.decoder.fusion is not None:
+            # cached fused entries cover several instructions, the other loops want one each
+            self.decoder.fusion = None
+            self.decoder.flush()
+
+        # take in console input that arrived since the last slice
+        if self.console is not None:
+            self.console.drain()
+
+        done = 0
+        while True:
+            done += loop(None if limit is None else limit - done)
+            # an interrupt stops the loop like a halt does, but leaves halt_type alone. one raised from
+            # another thread can stop it after deliver() already took it, then there is nothing to take
+            if self.running or self.halt_type is not None:
+                break
+            self.running = True
+            self.deliver()
+            if self.console is not None:
+                self.console.flush_idle()
+            if limit is not None and done >= limit:
+                break
+
+        if not self.running:
+            self.sync()
+        return done
+
+    def interrupt(self, id:int):
+        "Raise a hardware interrupt, taken before the next instruction. Devices may call this from any thread"
+        # raised again before it was taken, it is still only taken once
+        if id not in self.pending:
+            self.pending.append(id)
+        # the run loops already check running after every dispatch, so this costs them nothing
+        self.running = False
+
+    def deliver(self):
+        "Enter the handler of every pending interrupt, the last one raised runs first"
+        while self.pending:
+            id = self.pending.pop(0)
+            # nobody is listening
+            if self.ram.int_start is None:
+                continue
+            try:
+                target = self.ram.find_int(id)
+            except undefinedInt:
+                continue
+            if not target:
+                continue
+            # the handler can land between a compare and its jump, so the flags are kept
+            # on the stack with the return address and put back on the way out
+            try:
+                self.ram.push_address(self.counter)
+                self.ram.push_double(self.carry | self.zero << 1)
+                self.ram.push_address(INTERRUPT_RETURN)
+            except pageFault:
+                raise executionError(f"Page fault while entering the handler for interrupt x{id:X} (resident page limit of {self.ram.max_pages} reached)")
+            self.counter = target
+
+    def interrupt_return(self, variant, params):
+        "Run when a hardware interrupt handler returns, pops the flags and return address deliver() pushed"
+        flags = self.ram.pop_double()
+        self.counter = self.ram.pop_address()
+        self.carry = bool(flags & 1)
+        self.zero = bool(flags & 2)
+
+    def sync(self):
+        "Have every device write out what it holds back, such as disk sectors"
+        for device in self.ram.devices:
+            device.sync()
+
+    def close(self):
+        "Write out and let go of everything the devices hold on the host, such as sockets and timer threads"
+        self.sync()
+        for device in self.ram.devices:
+            device.close()
+
+    def snapshot(self) -> dict:
+        "Capture the whole machine, ram pages are only copied once either side writes to them"
+        # devices finish what they are doing first, interrupts they raise on the way end up in pending
+        devices = [device.snapshot() for device in self.ram.devices]
+        return {
+            "registers": self.registers.copy(),
+            "counter": self.counter,
+            "begininst": self.begininst,
+            "blocksize": self.blocksize,
+            "carry": self.carry,
+            "zero": self.zero,
+            "running": self.running,
+            "halt_type": self.halt_type,
+            "pending": self.pending.copy(),
+            "ram": self.ram.snapshot(),
+            "devices": devices,
+        }
+
+    def restore(self, snapshot:dict):
+        "Put the machine back to a snapshot, copying back only the pages written since"
+        # handlers and compiled blocks hold on to this very list
+        self.registers[:] = snapshot["registers"]
+        self.counter = snapshot["counter"]
+        self.begininst = snapshot["begininst"]
+        self.carry = snapshot["carry"]
+        self.zero = snapshot["zero"]
+        self.halt_type = snapshot["halt_type"]
+
+        if self.blocksize != snapshot["blocksize"]:
+            self.blocksize = snapshot["blocksize"]
+            self.ram.set_blocksize(self.blocksize)
+            self.decoder.flush()
+
+        for page in self.ram.restore(snapshot["ram"]):
+            if page in self.ram.code_pages:
+                self.decoder.invalidate_page(page)
+
+        for device, state in zip(self.ram.devices, snapshot["devices"]):
+            device.restore(state)
+
+        # after the devices, a disk command they finish raises its interrupt into what gets replaced here
+        self.running = snapshot["running"]
+        self.pending[:] = snapshot["pending"]
+        if self.pending and self.halt_type is None:
+            self.running = False
+
+    def main(self, disk:str, stdin, overlay:bool=False):
+        self.boot(disk, stdin, overlay=overlay)
+        self.run()
+
+    def run_plain(self, limit:int=None) -> int:
+        "Interpreter loop without any timing, tracing or recursion bookkeeping, returns the instructions run"
+        fusion = self.decoder.fusion
+        if fusion is None:
+            return self.interpret(limit)
+
+        # interpret() counts one instruction per dispatch, fused entries count the rest of theirs
+        start = fusion.saved()
+        done = 0
+        try:
+            if limit is None:
+                done = self.interpret()
+                done += fusion.saved() - start
+                return done
+            # no dispatch runs more than fusion.longest instructions, so rounds this short never overshoot
+            while self.running and limit - done >= fusion.longest:
+                before = fusion.saved()
+                done += self.interpret((limit - done) // fusion.longest)
+                done += fusion.saved() - before
+            # the last few go one instruction at a time, a fused entry could run past the budget
+            if self.running and done < limit:
+                done += self.interpret(limit - done, single=True)
+            return done
+        finally:
+            self.executed += fusion.saved() - start
+
+    def interpret(self, limit:int=None, single:bool=False) -> int:
+        "Run up to limit decoded entries, only unfused ones when single is set, returns how many ran"
+        decoded = {} if single else self.decoder.cache
+        decode = self.decoder.single if single else self.decoder.decode
+
+        done = 0
+        try:
+            for done in (itertools.count() if limit is None else range(limit)):
+                if not self.running:
+                    break
+
+                pc = self.begininst = self.counter
+                try:
+                    handler, variant, params, length = decoded[pc]
+                except KeyError:
+                    handler, variant, params, length = decode(pc)
+                self.counter = pc + length
 
-        while self.running:
-            self.params = []
-            prev_time = time.perf_counter_ns()
+                if handler is None:
+                    self.int_fault(0x101)
+                    continue
 
-            self.begininst = self.counter
-            opcode = self.fetch()
-            variant = self.fetch()
-            try:
-                info = self.opcodes.OPCODES[opcode]
-                name:str = info["mnemonic"]
-            except KeyError:
-                name = "?" + format(opcode,"X")
-            
-            prev_addr = self.counter
-            
-            if self.do_trace and tracing:
-                # counter,
-                # opcode value,
-                # opcode name,
-                # parameters,
-                # registers,
-                # flags,
-                # (relevant ram address, relevant ram value)
-                # was a jump done
-                ram_revalence = r"(^(?:ST|LD)[AXY]|^MOV)?[WDQ]"
-                jumped = self.counter != prev_addr
                 try:
-                    rammed = (self.params[0], self.ram.load_bypass_dev(self.params[0])) if re.match(ram_revalence, name) else (self.registers[1], self.ram.load_bypass_dev(self.registers[1])) if (name.startswith("LDV") or name.startswith("STV")) else None
+                    handler(variant, params)
                 except pageFault:
-                    rammed = (self.params[0], 0) if re.match(ram_revalence, name) else (self.registers[1], self.ram.load_bypass_dev(self.registers[1])) if (name.startswith("LDV") or name.startswith("STV")) else None
+                    self.int_fault(0x102)
+                except ivtOverflow:
+                    self.int_fault(0x103)
+                except undefinedInt:
+                    self.int_fault(0x100)
+            else:
+                done = limit
+        finally:
+            # counted however the loop ends, an instruction that raised out of it did not run
+            self.executed += done
+
+        return done
+
+    def run_instrumented(self, limit:int=None) -> int:
+        "Interpreter loop that times, traces or counts every instruction as asked"
+        recursion_table = self.recursion_table
+
+        decoded = self.decoder.cache
+
+        done = 0
+        try:
+            for done in (itertools.count() if limit is None else range(limit)):
+                if not self.running:
+                    break
+
+                if self.do_time:
+                    prev_time = time.perf_counter_ns()
+
+                pc = self.begininst = self.counter
                 try:
-                    self.trace.append((
-                        self.begininst,
-                        opcode, name,
-                        self.params.copy() + [0]*(2-len(self.params)),
-                        self.registers.copy(),
-                        (self.carry, self.zero),
-                        rammed,
-                        jumped
-                    ))
-                except IndexError:
-                    print(f"{opcode:X} {name} {self.params} {prev_addr:X}")
-                    raise IndexError
-            if self.do_trace and self.counter == 0: # begin tracing on the true start of the program
-                tracing = True
+                    handler, variant, params, length = decoded[pc]
+                except KeyError:
+                    handler, variant, params, length = self.decoder.decode(pc)
+                self.counter = pc + length
+                self.params = list(params)
+
+                prev_addr = self.counter
             
-            try:
-                if not name.startswith("?"):
-                    self.executor.execute(name,variant)
-            except pageFault:
-                self.int_fault(0x102)
-                continue
-            except ivtOverflow:
-                self.int_fault(0x103)
-                continue
-            except undefinedInt:
-                self.int_fault(0x100)
-                continue
-            self.time.append(time.perf_counter_ns()-prev_time)
+                if self.do_trace and self.tracing:
+                    opcode = self.ram.load_bypass_dev(pc)
+                    try:
+                        name:str = self.opcodes.OPCODES[opcode]["mnemonic"]
+                    except KeyError:
+                        name = "?" + format(opcode,"X")
+                    # counter,
+                    # opcode value,
+                    # opcode name,
+                    # parameters,
+                    # registers,
+                    # flags,
+                    # (relevant ram address, relevant ram value)
+                    # was a jump done
+                    ram_revalence = r"(^(?:ST|LD)[AXY]|^MOV)?[WDQ]"
+                    jumped = self.counter != prev_addr
+                    try:
+                        rammed = (self.params[0], self.ram.load_bypass_dev(self.params[0])) if re.match(ram_revalence, name) else (self.registers[1], self.ram.load_bypass_dev(self.registers[1])) if (name.startswith("LDV") or name.startswith("STV")) else None
+                    except pageFault:
+                        rammed = (self.params[0], 0) if re.match(ram_revalence, name) else (self.registers[1], self.ram.load_bypass_dev(self.registers[1])) if (name.startswith("LDV") or name.startswith("STV")) else None
+                    try:
+                        self.trace.append((
+                            self.begininst,
+                            opcode, name,
+                            self.params.copy() + [0]*(2-len(self.params)),
+                            self.registers.copy(),
+                            (self.carry, self.zero),
+                            rammed,
+                            jumped
+                        ))
+                    except IndexError:
+                        print(f"{opcode:X} {name} {self.params} {prev_addr:X}")
+                        raise IndexError
+                if self.do_trace and self.counter == 0: # begin tracing on the true start of the program
+                    self.tracing = True
             
-            if self.block_recursion:
-                if self.counter not in recursion_table:
-                    recursion_table[self.counter] = 0
-                recursion_table[self.counter] += 1
-                if recursion_table[self.counter] > self.recursion_limit:
-                    raise executionError(f"Recursion/Infinite loop blocked: instruction at x{self.counter:X} executed too many times")
-            if name.startswith("?"):
-                self.int_fault(0x101)
+                try:
+                    if handler is not None:
+                        handler(variant, params)
+                except pageFault:
+                    self.int_fault(0x102)
+                    continue
+                except ivtOverflow:
+                    self.int_fault(0x103)
+                    continue
+                except undefinedInt:
+                    self.int_fault(0x100)
+                    continue
+                if self.do_time:
+                    self.time.append(time.perf_counter_ns()-prev_time)
+            
+                if self.block_recursion:
+                    if self.counter not in recursion_table:
+                        recursion_table[self.counter] = 0
+                    recursion_table[self.counter] += 1
+                    if recursion_table[self.counter] > self.recursion_limit:
+                        raise executionError(f"Recursion/Infinite loop blocked: instruction at x{self.counter:X} executed too many times")
+                if handler is None:
+                    self.int_fault(0x101)
+            else:
+                done = limit
+        finally:
+            self.executed += done
+
+        return done
+
+    def step(self):
+        "Interpret a single instruction"
+        pc = self.begininst = self.counter
+        try:
+            handler, variant, params, length = self.decoder.cache[pc]
+        except KeyError:
+            handler, variant, params, length = self.decoder.decode(pc)
+        self.counter = pc + length
 
-        return
+        if handler is None:
+            self.int_fault(0x101)
+        else:
+            handler(variant, params)
+
+    def run_blocks(self, limit:int=None) -> int:
+        "Run translated basic blocks, interpreting whatever the translator refuses"
+        blocks = self.translator.blocks
+        translate = self.translator.translate
+
+        done = 0
+        try:
+            while limit is None or done < limit:
+                if not self.running:
+                    break
 
+                try:
+                    block = blocks[self.counter]
+                except KeyError:
+                    block = translate(self.counter)
+                # a block that would run past the budget is left to the interpreter
+                if block is not None and limit is not None and block.length > limit - done:
+                    block = None
+
+                try:
+                    if block is None:
+                        self.step()
+                        done += 1
+                    else:
+                        done += block()
+                except pageFault:
+                    done += self.ran_before_fault(block)
+                    self.int_fault(0x102)
+                except ivtOverflow:
+                    done += self.ran_before_fault(block)
+                    self.int_fault(0x103)
+                except undefinedInt:
+                    done += self.ran_before_fault(block)
+                    self.int_fault(0x100)
+                except BaseException:
+                    # whatever ran before the instruction that raised out of the loop
+                    done += self.ran_before_fault(block) - 1
+                    raise
+        finally:
+            self.executed += done
+
+        return done
+
+    def ran_before_fault(self, block) -> int:
+        "Instructions a block or step ran up to and including the one that faulted"
+        if block is None:
+            return 1
+        # the block left the counter just past the faulting instruction
+        return block.ends[self.counter]
+
+    def count_page_accesses(self):
+        "Count guest loads and stores per page for ram.stats(), rebinding everything that holds ram's access methods"
+        self.ram.count_accesses()
+        self.executor.build_table()
+        self.decoder.flush()
 
     def core_dump(self):
         print(f"Stopped at x{self.counter:X}")
@@ -228,17 +559,19 @@ class Emulator:
         print(f"Y: {self.registers[2]:03}  (x{self.registers[2]:02X})")
 
     def dump_ram(self, long=False):
-        pages = dict(sorted(self.ram.data.items()))
+        pages = sorted(self.ram.data)
         print("\n<--- RAM DUMP --->")
-        for page, values in pages.items():
-            print(f"{page:X}","{")
+        for page in pages:
+            values = self.ram.read_range(page << 12, 0x1000)
+            lines = [f"{page:X} {{\n"]
             for idx, value in enumerate(values):
                 if not long:
                     char = ascii(chr(value))
-                    print(f"\t{idx:03X}: {value:02X} : {char}{' '*(8-len(char))}{'\n' if (idx % 4) == 3 else ''}",end="")
+                    lines.append(f"\t{idx:03X}: {value:02X} : {char}{' '*(8-len(char))}{'\n' if (idx % 4) == 3 else ''}")
                 else:
-                    print(f"\t{idx:016X}: {value:02X}")
-            print("}\n")
+                    lines.append(f"\t{idx:016X}: {value:02X}\n")
+            lines.append("}\n")
+            print("".join(lines))
     
     def dump_state(self):
         print("\n<--- STATE DUMP --->")
@@ -280,6 +613,15 @@ if __name__ == "__main__":
     parser.add_argument("-M", "--dump-file", help="dump memory to .dump in the current directory", action="store_true")
     parser.add_argument("-r", "--dump-raw", help="dump first contiguous pages in ram as a raw binary file", action="store_true")
     parser.add_argument("-g", "--graph", help="shows graph of execution time on halt", action="store_true")
+    parser.add_argument("-j", "--translate", help="run guest code as compiled basic blocks (ignored with --time, --graph, --trace or recursion blocking)", action="store_true")
+    parser.add_argument("-F", "--fusion-stats", help="print how often each fused instruction sequence ran on halt", action="store_true")
+    parser.add_argument("--no-fusion", help="run every instruction on its own instead of fusing common sequences", action="store_true")
+    parser.add_argument("--max-pages", help="most 4 KiB pages of ram the guest may use, going over raises a page fault (interrupt 0x102)", type=int, default=None)
+    parser.add_argument("--memory-stats", help="print memory use and the most accessed pages on halt (counting slows every memory access)", action="store_true")
+    parser.add_argument("--overlay", help="keep disk writes in memory instead of writing them into the disk image, they are dropped on exit", action="store_true")
+    parser.add_argument("--commit", help="with --overlay, write the kept disk writes into the disk image on exit", action="store_true")
+    parser.add_argument("--raw-console", help="write the guest's console output to stdout as raw bytes instead of as characters", action="store_true")
+    parser.add_argument("--console", help="serve the console on a Unix domain socket at this path, or on a TCP port given as [host:]port (host defaults to 127.0.0.1)", default=None)
     parser.add_argument("-s", "--stdin", help="the stdin exposed to the system, prompt for one if empty. use \\ as newline", default=None, const="", action="store", nargs="?")
     
     parser.add_argument("--block-small-recursion", help="halt execution when a certain address is executed 1,000 times", action="store_true")
@@ -307,6 +649,19 @@ if __name__ == "__main__":
     print(color.RESET,end="")
 
     emulator.do_trace = bool(args.trace)
+    emulator.do_time = bool(args.time) or bool(args.graph)
+    emulator.translate = bool(args.translate)
+    emulator.fuse = not bool(args.no_fusion)
+    emulator.raw_console = bool(args.raw_console)
+    if args.console is not None:
+        if "/" in args.console or not args.console.rpartition(":")[2].isdigit():
+            emulator.console_address = args.console
+        else:
+            host, _, port = args.console.rpartition(":")
+            emulator.console_address = (host or "127.0.0.1", int(port))
+    emulator.ram.max_pages = args.max_pages
+    if bool(args.memory_stats):
+        emulator.count_page_accesses()
     emulator.block_recursion = bool(args.block_recursion)
     if bool(args.block_small_recursion):
         emulator.block_recursion = True
@@ -319,14 +674,19 @@ if __name__ == "__main__":
         sys.exit("Cannot use multiple recursion block flags at once")
 
     try:
-        emulator.main(source,stdin)
+        emulator.main(source,stdin,bool(args.overlay))
     except KeyboardInterrupt:
+        emulator.sync()
         print(color.fg.YELLOW+"INT"+color.RESET)
     except executionError as E:
+        emulator.sync()
         eprint(color.fg.RED + str(E) + color.RESET)
         emulator.halt_type = -1
 
     finally:
+        if bool(args.commit) and emulator.diskio is not None:
+            emulator.diskio.commit()
+        emulator.close()
         if verbose:
             eprint(color.fg.GRAY)
 
@@ -362,6 +722,20 @@ if __name__ == "__main__":
             print(f"{fg.GREEN}Mid :{RESET} {median_time:,.0f}ns")
             print(f"{fg.BLUE}Min :{RESET} {min_time:,.0f}ns")
             print(f"{fg.GRAY}Mean:{RESET} {average_time:,.0f}ns")
+        if bool(args.fusion_stats):
+            print("\nFused instruction sequences")
+            if emulator.decoder.fusion is None:
+                print(f"{fg.GRAY}Fusion was off for this run{RESET}")
+            else:
+                for name, ran, saved in emulator.decoder.fusion.report():
+                    print(f"{name.ljust(20)} {fg.GREEN}ran:{RESET} {ran:,}  {fg.BLUE}dispatches saved:{RESET} {saved:,}")
+        if bool(args.memory_stats):
+            stats = emulator.ram.stats()
+            print("\nMemory")
+            limit = "no limit" if stats["max_pages"] is None else f"limit {stats['max_pages']:,}"
+            print(f"{fg.GREEN}pages:{RESET} {stats['pages']:,} ({stats['bytes']:,} bytes, {limit})  {fg.BLUE}dirty:{RESET} {stats['dirty']:,}")
+            for page, count in stats["top"]:
+                print(f"x{page << 12:08X} {fg.GRAY}accesses:{RESET} {count:,}")
         if bool(args.graph):
             if verbose:
                 eprint("Graphing")
@@ -386,18 +760,11 @@ if __name__ == "__main__":
                 eprint("Writing raw dump")
             def get_contiguous_pages():
                 pages = 0
-                for p in range(len(emulator.ram.page_to_frame)):
-                    try:
-                        emulator.ram.page_to_frame[p]
-                        pages += 1
-                    except KeyError:
-                        break
+                while pages in emulator.ram.data:
+                    pages += 1
                 return pages
             with open(".ram","wb") as rawdump:
-                buffer = bytearray()
-                for idx in range(get_contiguous_pages()*0x1000):
-                    buffer.append(emulator.ram.load(idx))
-                rawdump.write(buffer)
+                rawdump.write(emulator.ram.read_range(0, get_contiguous_pages()*0x1000))
 
         if verbose:
             eprint(color.RESET,end="")
@@ -10,17 +10,67 @@ class ivtOverflow(Exception):
 class undefinedInt(Exception):
     pass
 
+# what every page nobody has written to reads as
+ZERO_PAGE = bytes(0x1000)
+
+class RamSnapshot:
+    "Pages and pointers of a Ram at one point in time, pages are shared until written"
+    def __init__(self, pages:dict[int,bytearray], stack_start:int, stack_pos:int, int_start:int):
+        self.pages = pages
+        self.stack_start = stack_start
+        self.stack_pos = stack_pos
+        self.int_start = int_start
+
 class Ram:
     def __init__(self):
-        self.data:dict[(int,list[int])] = {} # dict of int:frames(dict of int:int)
+        # page number -> frame (4 KiB bytearray), only pages written to are resident.
+        # Page numbers are 20 bits in 32 bit mode and 52 bits in 64 bit mode, the dict
+        # is the page table for both: one lookup per page however sparse the layout is
+        self.data:dict[(int,bytearray)] = {}
+        self.mask = 0xFFFF_FFFF
+        # most pages allowed to be resident at once, None for no limit
+        self.max_pages:int = None
+        # page -> loads and stores to it, only kept after count_accesses()
+        self.accesses:dict[int,int] = None
 
-        self.ports:list[device.Port] = []
+        self.devices:list[device.Device] = []
+        # devices claim address ranges here, ordinary pages never look at it
+        self.bus = device.Bus()
+        self.device_pages = self.bus.pages
+        # where register_port maps the next port
+        self.next_port = 0xFE00_0000
 
         self.stack_start = 0
         self.stack_pos = 0
 
         self.int_start = None
 
+        # return addresses and IVT entries, as wide as an address
+        self.push_address = self.push_double
+        self.pop_address = self.pop_double
+        self.load_address = self.load_double
+        self.store_address = self.store_double
+
+        # pages holding decoded instructions, and who to tell when they change
+        self.code_pages:dict[int,int] = {}
+        self.on_code_write = None
+
+        # copy-on-write against the last snapshot taken or restored
+        self.base:RamSnapshot = None
+        self.shared:set[int] = set() # pages still owned by self.base
+        self.dirty:set[int] = set() # pages copied or created since then
+
+        # software TLB, page -> frame for pages that are safe to read and write directly:
+        # allocated, not shared with a snapshot, not holding decoded code and not device space
+        self.tlb:dict[int,bytearray] = {}
+        self.tlb_size = 8
+        # the last page the stack was in, one of the pages above
+        self.stack_page = None
+        self.stack_frame:bytearray = None
+        # the last page an instruction was fetched from, only ever read through
+        self.fetch_page = None
+        self.fetch_frame:bytes = None
+
     def push(self,value:int):
         self.store(self.stack_start-self.stack_pos,value)
         self.stack_pos += 1
@@ -38,21 +88,59 @@ class Ram:
         return self.load(self.stack_start-self.stack_pos)
 
     def push_double(self,value:int):
-        self.store_double(self.stack_start-self.stack_pos-3,value)
+        address = self.stack_start-self.stack_pos-3
+        offset = address & 0xFFF
+        if (address & self.mask) >> 12 == self.stack_page and offset <= 0xFFC:
+            self.stack_frame[offset:offset+4] = (value & 0xFFFF_FFFF).to_bytes(4, "little")
+        else:
+            self.store_double(address,value)
+            self.remember_stack(address)
         self.stack_pos += 4
 
     def pop_double(self):
         self.stack_pos -= 4
-        return self.load_double(self.stack_start-self.stack_pos-3)
+        address = self.stack_start-self.stack_pos-3
+        offset = address & 0xFFF
+        if (address & self.mask) >> 12 == self.stack_page and offset <= 0xFFC:
+            return int.from_bytes(self.stack_frame[offset:offset+4], "little")
+        value = self.load_double(address)
+        self.remember_stack(address)
+        return value
+
+    def push_quad(self,value:int):
+        address = self.stack_start-self.stack_pos-7
+        offset = address & 0xFFF
+        if (address & self.mask) >> 12 == self.stack_page and offset <= 0xFF8:
+            self.stack_frame[offset:offset+8] = (value & 0xFFFF_FFFF_FFFF_FFFF).to_bytes(8, "little")
+        else:
+            self.store_quad(address,value)
+            self.remember_stack(address)
+        self.stack_pos += 8
+
+    def pop_quad(self):
+        self.stack_pos -= 8
+        address = self.stack_start-self.stack_pos-7
+        offset = address & 0xFFF
+        if (address & self.mask) >> 12 == self.stack_page and offset <= 0xFF8:
+            return int.from_bytes(self.stack_frame[offset:offset+8], "little")
+        value = self.load_quad(address)
+        self.remember_stack(address)
+        return value
+
+    def remember_stack(self, address:int):
+        page = (address & self.mask) >> 12
+        frame = self.tlb.get(page)
+        self.stack_page = page if frame is not None else None
+        self.stack_frame = frame
 
     def register_int(self, id:int, target:int):
         if id > 512:
             raise ivtOverflow
 
-        self.store_double((id*8)+self.int_start,target)
+        self.store_address((id*8)+self.int_start,target)
 
     def find_int(self,id:int):
-        addr = self.load_double((id*8)+self.int_start)
+        addr = self.load_address((id*8)+self.int_start)
 
         if (addr == 0) and (id < 0x100):
             raise undefinedInt
@@ -60,39 +148,221 @@ class Ram:
         return addr
 
     def getaddr(self,virtualaddr:int):
-        page = (virtualaddr & 0xFFFF_F000 )>> 12
+        page = (virtualaddr & self.mask) >> 12
         address = virtualaddr & 0xFFF
-        if not (page in self.data.keys()):
-            self.data[page] = [0]*0x1000
         return page, address
 
+    def set_blocksize(self, blocksize:int):
+        "Addresses are 64 bits wide once operands are, 32 bits otherwise, and so are return addresses and IVT entries"
+        wide = blocksize >= 4
+        self.mask = 0xFFFF_FFFF_FFFF_FFFF if wide else 0xFFFF_FFFF
+        self.push_address = self.push_quad if wide else self.push_double
+        self.pop_address = self.pop_quad if wide else self.pop_double
+        self.load_address = self.load_quad if wide else self.load_double
+        self.store_address = self.store_quad if wide else self.store_double
+        self.flush_tlb()
+
+    def allocate(self, page:int) -> bytearray:
+        "Back a page with real memory, only ever done on the first store to it"
+        if self.max_pages is not None and len(self.data) >= self.max_pages:
+            raise pageFault
+        frame = self.data[page] = bytearray(0x1000)
+        self.dirty.add(page)
+        self.flush_tlb()
+        return frame
+
+    def flush_tlb(self):
+        "Forget every cached translation, done whenever a page gets a different frame"
+        self.tlb.clear()
+        self.stack_page = None
+        self.stack_frame = None
+        self.fetch_page = None
+        self.fetch_frame = None
+
+    def evict(self, page:int):
+        "Stop writing to a page directly, it now holds decoded code"
+        if self.tlb.pop(page, None) is not None and page == self.stack_page:
+            self.stack_page = None
+            self.stack_frame = None
+
+    def fetch(self, address:int, size:int):
+        "(page buffer, offset) to read `size` instruction bytes from, None across pages or in device space"
+        offset = address & 0xFFF
+        if offset > 0x1000 - size:
+            return None
+        page = (address & self.mask) >> 12
+        if page != self.fetch_page:
+            if page in self.device_pages:
+                return None
+            self.fetch_page = page
+            self.fetch_frame = self.data.get(page, ZERO_PAGE)
+        return self.fetch_frame, offset
+
+    def count_accesses(self):
+        "Count guest loads and stores per page from now on, every access gets slower"
+        if self.accesses is not None:
+            return
+        self.accesses = accesses = {}
+        # accesses made from inside another one (page crossing fallbacks) aren't counted again
+        busy = [False]
+
+        def counted(method, stack=False):
+            def wrapper(*args):
+                if busy[0]:
+                    return method(*args)
+                busy[0] = True
+                try:
+                    if stack:
+                        # the byte next to the stack top, where a push starts and a pop ends
+                        address = self.stack_start - self.stack_pos + (0 if args else 1)
+                    else:
+                        address = args[0]
+                    page = (address & self.mask) >> 12
+                    accesses[page] = accesses.get(page, 0) + 1
+                    return method(*args)
+                finally:
+                    busy[0] = False
+            return wrapper
+
+        for name in ("load","load_word","load_double","load_quad","store","store_word","store_double","store_quad"):
+            setattr(self, name, counted(getattr(self, name)))
+        for name in ("push","push_word","push_double","push_quad","pop","pop_word","pop_double","pop_quad"):
+            setattr(self, name, counted(getattr(self, name), stack=True))
+        # rebound to the counted ones above
+        self.set_blocksize(4 if self.mask > 0xFFFF_FFFF else 2)
+
+    def stats(self, top:int=10) -> dict:
+        "Memory use, and the most used pages when accesses are counted"
+        resident = len(self.data)
+        return {
+            "pages": resident,
+            "bytes": resident * 0x1000,
+            "dirty": len(self.dirty),
+            "shared": len(self.shared),
+            "max_pages": self.max_pages,
+            "top": [] if self.accesses is None else sorted(self.accesses.items(), key=lambda item: item[1], reverse=True)[:top],
+        }
+
+    def snapshot(self) -> RamSnapshot:
+        "Capture every page without copying any, the next write to a page copies it instead"
+        snapshot = RamSnapshot(dict(self.data), self.stack_start, self.stack_pos, self.int_start)
+        self.base = snapshot
+        self.shared = set(self.data)
+        self.dirty = set()
+        self.flush_tlb()
+        return snapshot
+
+    def restore(self, snapshot:RamSnapshot) -> set[int]:
+        "Go back to a snapshot, returns the pages whose contents may have changed"
+        if snapshot is self.base:
+            # only what was written since needs to go back
+            changed = self.dirty
+            for page in changed:
+                if page in snapshot.pages:
+                    self.data[page] = snapshot.pages[page]
+                    self.shared.add(page)
+                else:
+                    self.data.pop(page, None)
+        else:
+            changed = set(self.data) | set(snapshot.pages)
+            self.data.clear()
+            self.data.update(snapshot.pages)
+            self.base = snapshot
+            self.shared = set(snapshot.pages)
+
+        self.dirty = set()
+        self.flush_tlb()
+        self.stack_start = snapshot.stack_start
+        self.stack_pos = snapshot.stack_pos
+        self.int_start = snapshot.int_start
+        return changed
+
+    def unshare(self, page:int):
+        "Give this Ram its own copy of a page a snapshot still holds"
+        self.data[page] = bytearray(self.data[page])
+        self.shared.discard(page)
+        self.dirty.add(page)
+        self.flush_tlb()
+
     def register_port(self, port:device.Port):
-        self.ports.append(port)
+        self.map_ports(self.next_port, [port])
+        self.next_port += 1
+
+    def register_device(self,device:device.Device,address:int=None):
+        "Attach a device, its ports go after the last registered port unless an address is given"
+        self.devices.append(device)
+        if address is None:
+            device.set_port(self.register_port)
+            return
+        ports = []
+        device.set_port(ports.append)
+        self.map_ports(address, ports)
 
-    def register_device(self,device:device.Device):
-        device.set_port(self.register_port)
+    def map_ports(self, address:int, ports:list[device.Port]):
+        self.bus.claim(address, *ports)
+        # a page turned into device space stops being memory
+        for page in self.device_pages:
+            if self.data.pop(page, None) is not None:
+                self.shared.discard(page)
+                self.dirty.add(page)
+        self.flush_tlb()
 
     def load(self, address:int):
         page, address = self.getaddr(address)
 
-        try:
-            if page == 0xFE000:
-                device = self.ports[address]
-                return device.read()
-        except IndexError:
-            pass
-        
-        try:
-            page = self.data[page]
-        except KeyError:
-            raise pageFault
+        frame = self.data.get(page)
+        if frame is not None:
+            return frame[address]
+        if page in self.device_pages:
+            return self.bus.read(page << 12 | address)
+        return 0
 
-        try:
-            return page[address]
-        except KeyError:
-            return 0
+    def span(self, address:int, size:int, write=False):
+        "(page buffer, offset) when `size` bytes at address sit in one allocated ordinary page, else None"
+        offset = address & 0xFFF
+        if offset > 0x1000 - size:
+            return None
+        page = (address & self.mask) >> 12
+        frame = self.tlb.get(page)
+        if frame is not None:
+            return frame, offset
+        if page in self.device_pages:
+            return None
+        frame = self.data.get(page)
+        if frame is None:
+            if not write:
+                return ZERO_PAGE, offset
+            frame = self.allocate(page)
+
+        if write:
+            if page in self.code_pages:
+                base = page << 12 | offset
+                for idx in range(size):
+                    self.on_code_write(base + idx)
+            if page in self.shared:
+                self.unshare(page)
+                frame = self.data[page]
+            self.cache_page(page, frame)
+        return frame, offset
+
+    def cache_page(self, page:int, frame:bytearray):
+        "Remember a page that was just written to through the slow path"
+        if page in self.code_pages:
+            return
+        if len(self.tlb) >= self.tlb_size:
+            self.tlb.clear()
+            self.stack_page = None
+            self.stack_frame = None
+        self.tlb[page] = frame
+
+    # the multi-byte accesses below fall back to one byte at a time, in the original order,
+    # when they cross a page or touch a device page
 
     def load_quad(self, address:int):
+        span = self.span(address, 8)
+        if span:
+            frame, offset = span
+            return int.from_bytes(frame[offset:offset+8], "little")
         return (
             self.load(address+7) << 56 |
             self.load(address+6) << 48 |
@@ -105,6 +375,11 @@ class Ram:
         )
     
     def store_quad(self, address:int, value:int):
+        span = self.span(address, 8, True)
+        if span:
+            frame, offset = span
+            frame[offset:offset+8] = (value & 0xFFFF_FFFF_FFFF_FFFF).to_bytes(8, "little")
+            return
         self.store(address,value,)
         self.store(address+1,value >> 8)
         self.store(address+2,value >> 16)
@@ -115,45 +390,131 @@ class Ram:
         self.store(address+7,value >> 56)
 
     def load_double(self, address:int):
+        span = self.span(address, 4)
+        if span:
+            frame, offset = span
+            return int.from_bytes(frame[offset:offset+4], "little")
         return self.load(address+3) << 24 | self.load(address+2) << 16 | self.load(address+1) << 8 | self.load(address)
     
     def store_double(self, address:int, value:int):
+        span = self.span(address, 4, True)
+        if span:
+            frame, offset = span
+            frame[offset:offset+4] = (value & 0xFFFF_FFFF).to_bytes(4, "little")
+            return
         self.store(address,value,)
         self.store(address+1,value >> 8)
         self.store(address+2,value >> 16)
         self.store(address+3,value >> 24)
 
     def load_word(self, address:int):
+        span = self.span(address, 2)
+        if span:
+            frame, offset = span
+            return frame[offset] | frame[offset+1] << 8
         return self.load(address+1) << 8 | self.load(address)
     
     def store_word(self, address:int, value:int):
+        span = self.span(address, 2, True)
+        if span:
+            frame, offset = span
+            frame[offset] = value & 0xFF
+            frame[offset+1] = (value >> 8) & 0xFF
+            return
         self.store(address,value,)
         self.store(address+1,value >> 8)
     
+    # bulk access for the host side, a page at a time. Device pages are skipped over:
+    # they read as zeros and writes to them are dropped
+
+    def chunks(self, address:int, size:int):
+        "(page, offset, position, length) for every page piece of a range, position counts from the range start"
+        position = 0
+        while position < size:
+            address &= self.mask
+            page = address >> 12
+            offset = address & 0xFFF
+            length = min(0x1000 - offset, size - position)
+            yield page, offset, position, length
+            address += length
+            position += length
+
+    def read_range(self, address:int, size:int) -> bytes:
+        "size bytes from address"
+        if size <= 0:
+            return b""
+        parts = []
+        for page, offset, _, length in self.chunks(address, size):
+            frame = ZERO_PAGE if page in self.device_pages else self.data.get(page, ZERO_PAGE)
+            parts.append(frame[offset:offset+length])
+        return b"".join(parts)
+
+    def write_range(self, address:int, data:"bytes|bytearray|memoryview"):
+        "Copy data into memory from address on"
+        data = memoryview(data).cast("B")
+        for page, offset, position, length in self.chunks(address, len(data)):
+            piece = data[position:position+length]
+            if page in self.device_pages:
+                continue
+            frame = self.data.get(page)
+            if frame is None:
+                if not any(piece):
+                    continue
+                frame = self.allocate(page)
+            self.write_frame(page, offset, piece)
+
+    def fill(self, address:int, size:int, value:int=0):
+        "Set size bytes from address to value"
+        value &= 0xFF
+        for page, offset, _, length in self.chunks(address, size):
+            if page in self.device_pages:
+                continue
+            if page not in self.data:
+                if not value:
+                    continue
+                self.allocate(page)
+            self.write_frame(page, offset, bytes((value,))*length)
+
+    def copy(self, dest:int, source:int, size:int):
+        "Copy size bytes from source to dest, the ranges may overlap"
+        self.write_range(dest, self.read_range(source, size))
+
+    def write_frame(self, page:int, offset:int, piece:"bytes|memoryview"):
+        if page in self.code_pages:
+            base = page << 12 | offset
+            for idx in range(len(piece)):
+                self.on_code_write(base + idx)
+        if page in self.shared:
+            self.unshare(page)
+        self.data[page][offset:offset+len(piece)] = piece
+
     def load_bypass_dev(self, address:int):
         page, address = self.getaddr(address)
 
-        try:
-            return self.data[page][address]
-        except KeyError:
-            return 0
+        return self.data.get(page, ZERO_PAGE)[address]
 
     def store(self, address:int, value:int):
 
         page, address = self.getaddr(address)
         value = value & 0xFF
+        frame = self.tlb.get(page)
+        if frame is not None:
+            frame[address] = value
+            return
         #print(f"{page:5x} {address:3x} {len(self.data[page])}")
         # device
-        if page == 0xFE000:
-            try:
-                device = self.ports[address]
-                device.write(value)
-                return
-            except IndexError:
-                pass
+        if page in self.device_pages:
+            self.bus.write(page << 12 | address, value)
+            return
+
+        if page in self.code_pages:
+            self.on_code_write(page << 12 | address)
+        if page in self.shared:
+            self.unshare(page)
 
         try:
-            page = self.data[page]
+            frame = self.data[page]
         except KeyError:
-            raise pageFault
-        page[address] = value
+            frame = self.allocate(page)
+        frame[address] = value
+        self.cache_page(page, frame)
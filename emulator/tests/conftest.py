@@ -0,0 +1,72 @@
+import itertools
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+EMULATOR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSEMBLER = os.path.join(os.path.dirname(EMULATOR), "assembler-v2", "main.py")
+EXAMPLES = os.path.join(os.path.dirname(EMULATOR), "examples-v2")
+
+# the emulator's modules import each other by their bare names
+sys.path.insert(0, EMULATOR)
+
+
+@pytest.fixture
+def assemble(tmp_path):
+    "Assemble guest source into a disk image padded to size bytes, returns the image's path"
+    names = itertools.count()
+    def assemble(source:str, size:int=0x1000) -> str:
+        name = next(names)
+        source_path = tmp_path / f"guest{name}.asm"
+        binary_path = tmp_path / f"guest{name}.bin"
+        image_path = tmp_path / f"guest{name}.img"
+        source_path.write_text(source)
+        subprocess.run([sys.executable, ASSEMBLER, str(source_path), "-o", str(binary_path)], check=True, stdout=subprocess.DEVNULL)
+        image = binary_path.read_bytes()
+        image_path.write_bytes(image + bytes(max(0, size - len(image))))
+        return str(image_path)
+    return assemble
+
+
+@pytest.fixture
+def example(assemble):
+    "A fresh disk image of one of the example programs"
+    def example(name:str) -> str:
+        with open(os.path.join(EXAMPLES, f"{name}.asm")) as source:
+            return assemble(source.read())
+    return example
+
+
+@pytest.fixture
+def run_guest(capsys):
+    "Boot an image the way the command line does, returns the emulator and what the guest printed, without the NULs the BIOS print routine ends every string with"
+    from main import Emulator
+    def run_guest(image:str, stdin:str="\n", **settings):
+        emulator = Emulator()
+        for name, value in settings.items():
+            setattr(emulator, name, value)
+        try:
+            emulator.main(image, stdin)
+        except KeyboardInterrupt:
+            # stdin given as a string ran out, the way guests that read forever stop
+            pass
+        return emulator, capsys.readouterr().out.replace("\0", "")
+    return run_guest
+
+
+@pytest.fixture
+def boot_guest():
+    "Boot an image's bytes through the library API, returns the emulator and the buffer it prints into"
+    from main import Emulator
+    def boot_guest(image:str, stdin:str="\n", **settings):
+        emulator = Emulator()
+        for name, value in settings.items():
+            setattr(emulator, name, value)
+        output = bytearray()
+        with open(image, "rb") as file:
+            emulator.boot(file.read(), stdin, output=output)
+        return emulator, output
+    return boot_guest
@@ -0,0 +1,56 @@
+import io
+import json
+from pathlib import Path
+
+import batch
+
+
+def test_job_reports_output_and_instructions(example):
+    result = batch.run_job({"id": 0, "image": example("hello_world")})
+    assert result["stop"] == "halt"
+    assert result["output"].replace("\0", "") == "Hello, World!\n"
+    assert result["instructions"] > 0
+
+
+def test_job_that_runs_out_of_input_counts_its_instructions(example):
+    result = batch.run_job({"id": 0, "image": example("echo"), "stdin": "hi\n"})
+    assert result["stop"] == "input"
+    assert "hi" in result["output"]
+    assert result["instructions"] > 0
+
+
+def test_job_stops_at_its_limit(example):
+    result = batch.run_job({"id": 0, "image": example("echo"), "stdin": "hi\n", "limit": 100})
+    assert result["stop"] == "limit"
+    assert result["instructions"] == 100
+
+
+def test_missing_image_is_reported(tmp_path):
+    result = batch.run_job({"id": 0, "image": str(tmp_path / "missing.img")})
+    assert result["stop"] == "error"
+    assert "not found" in result["error"]
+
+
+def test_jobs_leave_the_image_alone(example):
+    image = example("disk")
+    before = Path(image).read_bytes()
+    result = batch.run_job({"id": 0, "image": image, "stdin": "w1\nhello disk\nr1\n"})
+    assert "hello disk" in result["output"]
+    assert Path(image).read_bytes() == before
+
+
+def test_manifest_results_come_back_in_order(example, tmp_path):
+    manifest = tmp_path / "jobs.jsonl"
+    jobs = [
+        {"image": Path(example("hello_world")).name},
+        {"image": Path(example("echo")).name, "stdin": "one\n"},
+        {"image": Path(example("echo")).name, "stdin": "two\n", "id": "last"},
+    ]
+    manifest.write_text("\n".join(json.dumps(job) for job in jobs) + "\n")
+
+    output = io.StringIO()
+    batch.main(str(manifest), workers=2, output=output)
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [result["id"] for result in results] == [0, 1, "last"]
+    assert [result["stop"] for result in results] == ["halt", "input", "input"]
+    assert "two" in results[2]["output"]
@@ -0,0 +1,213 @@
+import os
+import select
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from device import SerialConsole, SocketConsole
+from main import Emulator
+
+
+@pytest.fixture
+def quiet_console():
+    "A console taking input from a pipe nobody writes to"
+    read, write = os.pipe()
+    console = SerialConsole(None, bytearray(), source=read)
+    yield console
+    console.detach()
+    os.close(read)
+    os.close(write)
+
+
+def test_polling_an_empty_console_waits_for_input(quiet_console):
+    console = quiet_console
+    console.idle_wait = 0.01
+    for _ in range(console.idle_after):
+        assert console.read() == 0
+
+    begin = time.perf_counter()
+    for _ in range(10):
+        assert console.read() == 0
+    assert time.perf_counter() - begin >= 0.09
+
+
+def test_printing_stops_the_wait(quiet_console):
+    console = quiet_console
+    console.idle_wait = 0.5
+    for _ in range(console.idle_after - 1):
+        console.read()
+    # the guest printed something, it isn't polling yet
+    console.write(ord("?"))
+    begin = time.perf_counter()
+    assert console.read() == 0
+    assert time.perf_counter() - begin < 0.25
+
+
+def test_polling_guest_keeps_to_a_timed_run(example):
+    read, write = os.pipe()
+    emulator = Emulator()
+    emulator.boot(example("echo"), output=bytearray(), console_input=read)
+    try:
+        begin = time.perf_counter()
+        for _ in range(5):
+            emulator.run(nanoseconds=20_000_000)
+        assert time.perf_counter() - begin < 0.5
+    finally:
+        emulator.console.detach()
+        os.close(read)
+        os.close(write)
+
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+def test_output_waits_for_a_newline(capsys):
+    console = SerialConsole("")
+    for byte in b"ab":
+        console.write(byte)
+    assert capsys.readouterr().out == ""
+    console.write(10)
+    assert capsys.readouterr().out == "ab\n"
+
+
+def test_reading_flushes_the_prompt(capsys):
+    console = SerialConsole("q")
+    console.write(ord(">"))
+    assert console.read() == ord("q")
+    assert capsys.readouterr().out == ">"
+    console.sync()
+    # the string stdin is echoed like typed input
+    assert capsys.readouterr().out == "q"
+
+
+def test_idle_output_is_flushed(capsys):
+    console = SerialConsole("")
+    console.flush_after = 0.01
+    console.write(ord("."))
+    assert capsys.readouterr().out == ""
+    time.sleep(0.02)
+    console.flush_idle()
+    assert capsys.readouterr().out == "."
+
+
+def test_raw_console_writes_bytes(capsysbinary):
+    console = SerialConsole("", raw=True)
+    for byte in b"\xE9\n":
+        console.write(byte)
+    assert capsysbinary.readouterr().out == b"\xE9\n"
+
+
+def test_partial_line_shows_while_the_guest_runs(assemble):
+    image = assemble("""
+main:
+    mov a, text
+    int x10
+spin:
+    jmp spin
+text:
+    .ascii Working...\\0
+""")
+    # stdin stays open, the guest never reads it
+    process = subprocess.Popen([sys.executable, MAIN, image], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        seen = b""
+        deadline = time.monotonic() + 10
+        while b"Working..." not in seen and time.monotonic() < deadline:
+            if select.select([process.stdout], [], [], 0.1)[0]:
+                seen += os.read(process.stdout.fileno(), 4096)
+        assert b"Working..." in seen
+        assert process.poll() is None
+    finally:
+        process.kill()
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+
+
+def test_input_arrives_through_a_pipe():
+    read, write = os.pipe()
+    console = SerialConsole(None, bytearray(), source=read)
+    try:
+        os.write(write, b"hi\n")
+        console.drain()
+        assert [console.read() for _ in range(3)] == list(b"hi\n")
+        assert console.read() == 0
+        # end of file lets go of the source, what arrived before stays readable
+        os.write(write, b"!")
+        os.close(write)
+        console.drain()
+        console.drain()
+        assert console.selector is None
+        assert console.read() == ord("!")
+    finally:
+        console.detach()
+        os.close(read)
+
+
+def test_guest_reads_piped_input(example):
+    read, write = os.pipe()
+    output = bytearray()
+    emulator = Emulator()
+    emulator.boot(example("echo"), output=output, console_input=read)
+    try:
+        os.write(write, b"hello\n")
+        deadline = time.monotonic() + 10
+        while output.count(b">") < 2 and time.monotonic() < deadline:
+            emulator.run(nanoseconds=10_000_000)
+        assert b"hello" in output
+        assert output.count(b">") == 2
+    finally:
+        emulator.console.detach()
+        os.close(read)
+        os.close(write)
+
+
+def connect(console:SocketConsole) -> socket.socket:
+    "A client attached to the console, and let in"
+    before = console.client
+    family = socket.AF_UNIX if isinstance(console.address, str) else socket.AF_INET
+    client = socket.socket(family, socket.SOCK_STREAM)
+    client.connect(console.address)
+    client.settimeout(5)
+    deadline = time.monotonic() + 5
+    while console.client is before and time.monotonic() < deadline:
+        console.drain()
+    assert console.client is not before
+    return client
+
+
+@pytest.mark.parametrize("unix", [True, False])
+def test_socket_console(tmp_path, unix):
+    console = SocketConsole(str(tmp_path / "console.sock") if unix else ("127.0.0.1", 0))
+    try:
+        # kept for whoever attaches first
+        for byte in b"early\n":
+            console.write(byte)
+
+        client = connect(console)
+        assert client.recv(64) == b"early\n"
+        client.sendall(b"k")
+        deadline = time.monotonic() + 5
+        while not console.buffer and time.monotonic() < deadline:
+            console.drain()
+        assert console.read() == ord("k")
+        for byte in b"late\n":
+            console.write(byte)
+        assert client.recv(64) == b"late\n"
+
+        # a new client takes over
+        other = connect(console)
+        assert client.recv(64) == b""
+        console.write(ord("\n"))
+        assert other.recv(64) == b"\n"
+        other.close()
+        client.close()
+        console.drain()
+        assert console.client is None
+    finally:
+        console.close()
+    if unix:
+        assert not (tmp_path / "console.sock").exists()
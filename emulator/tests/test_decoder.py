@@ -0,0 +1,42 @@
+from main import Emulator
+
+
+def test_overwritten_instruction_is_decoded_again(assemble, run_guest):
+    # the first pass runs `mov x, 1` and patches its operand, the second has to see `mov x, 7`
+    emulator, _ = run_guest(assemble("""
+main:
+patch:
+    mov x, 1
+    mov a, 7
+    mov [patch+2], a
+    cmp x, 7
+    jnz main
+halt
+"""))
+    assert emulator.registers[1] == 7
+    assert emulator.halt_type == 1
+
+
+def test_loop_is_decoded_once(assemble, capsys):
+    emulator = Emulator()
+    decoded = []
+    decode = emulator.decoder.decode
+    def counted(pc):
+        decoded.append(pc)
+        return decode(pc)
+    emulator.decoder.decode = counted
+
+    emulator.main(assemble("""
+main:
+    mov x, 0
+    mov y, 1
+loop:
+    add
+    mov x, a
+    cmp a, 100
+    jnz loop
+halt
+"""), "\\n")
+    assert emulator.registers[1] == 100
+    program = [pc for pc in decoded if pc < 0x1000]
+    assert program and len(program) == len(set(program))
@@ -0,0 +1,444 @@
+import threading
+import time
+
+import pytest
+
+import device
+from device import DiskIO, DMA_BASE, imageShared
+from main import Emulator
+
+
+SECTOR = 512
+
+
+def pattern(sectors:int) -> bytes:
+    "Every sector different, and no byte the same as its neighbour"
+    return bytes((idx*7 + idx//SECTOR) & 0xFF for idx in range(sectors*SECTOR))
+
+
+def set_sector(disk:DiskIO, sector:int):
+    disk.get_command(0x10)
+    for byte in sector.to_bytes(4, "little"):
+        disk.write(byte)
+
+
+def read_sector(disk:DiskIO, sector:int) -> bytes:
+    set_sector(disk, sector)
+    disk.get_command(0x20)
+    return bytes(disk.read() for _ in range(SECTOR))
+
+
+def write_sector(disk:DiskIO, sector:int, data:bytes):
+    set_sector(disk, sector)
+    disk.get_command(0x21)
+    for byte in data:
+        disk.write(byte)
+
+
+def test_writes_reach_the_file_on_flush(tmp_path):
+    path = tmp_path / "disk.img"
+    image = pattern(4)
+    path.write_bytes(image)
+    disk = DiskIO(str(path))
+    try:
+        assert read_sector(disk, 2) == image[2*SECTOR:3*SECTOR]
+        write_sector(disk, 1, b"\xAB" * SECTOR)
+        assert read_sector(disk, 1) == b"\xAB" * SECTOR
+        disk.get_command(0x40)
+        assert path.read_bytes() == image[:SECTOR] + b"\xAB" * SECTOR + image[2*SECTOR:]
+    finally:
+        disk.close()
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_pending_read_survives_growing(tmp_path, in_memory):
+    path = tmp_path / "disk.img"
+    image = pattern(2)
+    path.write_bytes(image)
+    disk = DiskIO(image if in_memory else str(path))
+    try:
+        set_sector(disk, 1)
+        disk.get_command(0x20)
+        first = bytes(disk.read() for _ in range(100))
+        disk.grow(8*SECTOR)
+        rest = bytes(disk.read() for _ in range(SECTOR - 100))
+        assert first + rest == image[SECTOR:]
+        assert disk.status() == 0
+        assert len(disk.image) == 8*SECTOR
+    finally:
+        disk.close()
+
+
+# reads sectors 1-2 in one run, writes them to 4-5 in another, then reads those back
+RUNS = """
+main:
+    mov a, 1
+    int 0x13
+    mov a, 0x2000
+    mov x, 2
+    int 0x16
+    mov a, 4
+    int 0x13
+    mov a, 0x2000
+    mov x, 2
+    int 0x17
+    mov a, 4
+    int 0x13
+    mov a, 0x1000
+    mov x, 2
+    int 0x16
+    mov a, 0x1000
+    int 0x10
+    mov a, 0x1200
+    int 0x10
+halt
+.org 512
+    .ascii first\\n\\0
+.org 1024
+    .ascii second\\n\\0
+.org 1536
+"""
+
+
+def test_runs_move_several_sectors(assemble, run_guest):
+    image = assemble(RUNS)
+    with open(image, "rb") as file:
+        before = file.read()
+    _, output = run_guest(image)
+    assert output == "first\nsecond\n"
+    with open(image, "rb") as file:
+        after = file.read()
+    assert after[4*SECTOR:6*SECTOR] == before[SECTOR:3*SECTOR]
+    assert after[:4*SECTOR] == before[:4*SECTOR]
+
+
+# reads sectors 1-2 into ram with DMA, the completion interrupt prints the first
+DMA = """
+const dma_sector xFE00_0100
+const dma_address xFE00_0104
+const dma_length xFE00_010C
+const dma_command xFE00_0110
+const dma_vector xFE00_0112
+
+main:
+    intr 0x180, done
+    mov a, 1
+    movd [dma_sector], a
+    mov a, 0x3000
+    movd [dma_address], a
+    mov a, 1024
+    movd [dma_length], a
+    mov a, 0x180
+    movw [dma_vector], a
+    mov a, 1
+    mov [dma_command], a
+    mov a, 0x3200
+    int 0x10
+halt
+
+done:
+    mov a, 0x3000
+    int 0x10
+ret
+.org 512
+    .ascii first\\n\\0
+.org 1024
+    .ascii second\\n\\0
+.org 1536
+"""
+
+
+def dma(ram, sector:int, address:int, length:int, command:int) -> int:
+    "Run one DMA transfer from the host the way a guest would, returns the status"
+    ram.store_double(DMA_BASE, sector)
+    ram.store_quad(DMA_BASE + 0x04, address)
+    ram.store_double(DMA_BASE + 0x0C, length)
+    ram.store(DMA_BASE + 0x10, command)
+    return ram.load(DMA_BASE + 0x11)
+
+
+def test_dma_reads_and_interrupts(assemble, run_guest):
+    _, output = run_guest(assemble(DMA))
+    assert output == "first\nsecond\n"
+
+
+def test_dma_moves_blocks_both_ways(assemble, boot_guest):
+    emulator, _ = boot_guest(assemble(DMA))
+    ram = emulator.ram
+    image = emulator.diskio.image
+    sectors = bytes(image[SECTOR:3*SECTOR])
+
+    assert dma(ram, 1, 0x1_0FF0, 2*SECTOR, 0x01) == 0
+    assert ram.read_range(0x1_0FF0, 2*SECTOR) == sectors
+    ram.fill(0x2_0000, SECTOR, 0x5A)
+    assert dma(ram, 6, 0x2_0000, SECTOR, 0x02) == 0
+    assert image[6*SECTOR:7*SECTOR] == b"\x5A" * SECTOR
+
+    # past the end of the disk nothing is moved, until the error is cleared
+    assert dma(ram, 7, 0x3_0000, 2*SECTOR, 0x01) == 0x31
+    assert ram.read_range(0x3_0000, 2*SECTOR) == bytes(2*SECTOR)
+    ram.store(DMA_BASE + 0x10, 0x30)
+    assert ram.load(DMA_BASE + 0x11) == 0
+    ram.store(DMA_BASE + 0x10, 0x77)
+    assert ram.load(DMA_BASE + 0x11) == 0x30
+
+
+def test_dma_registers_read_back(assemble, boot_guest):
+    emulator, _ = boot_guest(assemble(DMA))
+    ram = emulator.ram
+    ram.store_double(DMA_BASE, 0x1234_5678)
+    ram.store_quad(DMA_BASE + 0x04, 0x1122_3344_5566_7788)
+    ram.store_double(DMA_BASE + 0x0C, 0x400)
+    ram.store_word(DMA_BASE + 0x12, 0xFFFF)
+    values = [ram.load(DMA_BASE + offset) for offset in range(0x14)]
+    assert all(isinstance(value, int) for value in values)
+    assert ram.load_double(DMA_BASE) == 0x1234_5678
+    assert ram.load_quad(DMA_BASE + 0x04) == 0x1122_3344_5566_7788
+    assert ram.load_double(DMA_BASE + 0x0C) == 0x400
+    # the command register is write-only, and vectors stay inside the IVT
+    assert values[0x10] == 0
+    assert ram.load_word(DMA_BASE + 0x12) == 0x1FF
+
+
+def test_interrupt_without_a_handler_is_dropped(assemble, boot_guest):
+    emulator, output = boot_guest(assemble("""
+main:
+    mov a, text
+    int x10
+halt
+
+text:
+    .ascii still running\\n\\0
+"""))
+    ram = emulator.ram
+    ram.store_word(DMA_BASE + 0x12, 0x1C0)
+    assert dma(ram, 0, 0x8000, SECTOR, 0x01) == 0
+    emulator.run()
+    assert output.replace(b"\0", b"") == b"still running\n"
+    assert emulator.halt_type == 1
+
+
+def test_dma_write_past_the_end_during_a_read(tmp_path):
+    path = tmp_path / "disk.img"
+    image = pattern(2)
+    path.write_bytes(image)
+    emulator = Emulator()
+    emulator.boot(str(path), "\n", output=bytearray())
+    try:
+        disk = emulator.diskio
+        set_sector(disk, 1)
+        disk.get_command(0x20)
+        first = bytes(disk.read() for _ in range(100))
+        emulator.ram.fill(0x9000, SECTOR, 0xC3)
+        assert dma(emulator.ram, 4, 0x9000, SECTOR, 0x02) == 0
+        rest = bytes(disk.read() for _ in range(SECTOR - 100))
+        assert first + rest == image[SECTOR:]
+        assert read_sector(disk, 4) == b"\xC3" * SECTOR
+    finally:
+        emulator.diskio.close()
+
+
+def test_overlays_keep_writes_to_themselves(tmp_path):
+    path = tmp_path / "disk.img"
+    image = pattern(4)
+    path.write_bytes(image)
+    first = DiskIO(str(path), overlay=True)
+    second = DiskIO(str(path), overlay=True)
+    try:
+        write_sector(first, 1, b"\x11" * SECTOR)
+        assert read_sector(first, 1) == b"\x11" * SECTOR
+        assert read_sector(second, 1) == image[SECTOR:2*SECTOR]
+        first.get_command(0x40)
+        assert path.read_bytes() == image
+
+        # the other overlay still reads the image through the same pages
+        with pytest.raises(imageShared):
+            first.commit()
+        second.close()
+        first.commit()
+        assert path.read_bytes() == image[:SECTOR] + b"\x11" * SECTOR + image[2*SECTOR:]
+        assert read_sector(first, 1) == b"\x11" * SECTOR
+    finally:
+        first.close()
+        second.close()
+
+    third = DiskIO(str(path), overlay=True)
+    try:
+        assert read_sector(third, 1) == b"\x11" * SECTOR
+        write_sector(third, 2, b"\x22" * SECTOR)
+        third.discard()
+        assert read_sector(third, 2) == image[2*SECTOR:3*SECTOR]
+    finally:
+        third.close()
+
+
+@pytest.mark.parametrize("end", ["commit", "discard"])
+def test_pending_read_survives_commit_and_discard(tmp_path, end):
+    path = tmp_path / "disk.img"
+    image = pattern(4)
+    path.write_bytes(image)
+    disk = DiskIO(str(path), overlay=True)
+    try:
+        write_sector(disk, 3, b"\x33" * SECTOR)
+        set_sector(disk, 1)
+        disk.get_command(0x20)
+        first = bytes(disk.read() for _ in range(100))
+        getattr(disk, end)()
+        rest = bytes(disk.read() for _ in range(SECTOR - 100))
+        assert first + rest == image[SECTOR:2*SECTOR]
+        assert disk.status() == 0
+    finally:
+        disk.close()
+
+
+# reads sector 1 with a vector set, spinning until the completion interrupt sets a flag
+ASYNC_READ = """
+const disk_com xFE00_0001
+const disk_data xFE00_0002
+const disk_stat xFE00_0003
+const flag x4000
+const buf x5000
+
+main:
+    intr 0x181, done
+    mov a, disk_cmd_set_vector
+    mov [disk_com], a
+    mov a, 0x81
+    mov [disk_data], a
+    mov a, 0x01
+    mov [disk_data], a
+    mov a, 1
+    int x13
+    mov a, disk_cmd_read
+    mov [disk_com], a
+work:
+    mov x, [flag]
+    cmp x, 1
+    jnz work
+    mov x, buf
+    mov y, 1
+copy:
+    mov a, [disk_data]
+    stv
+    add
+    mov x, a
+    mov a, [disk_stat]
+    cmp a, 0
+    jnz copy
+    mov a, buf
+    int x10
+halt
+
+done:
+    mov a, 1
+    mov [flag], a
+ret
+.org 512
+    .ascii async read\\n\\0
+.org 1024
+"""
+
+# the same read through the BIOS, which has to wait the busy controller out itself
+BIOS_READ = """
+main:
+    intr 0x181, done
+    mov a, disk_cmd_set_vector
+    mov [xFE00_0001], a
+    mov a, 0x81
+    mov [xFE00_0002], a
+    mov a, 0x01
+    mov [xFE00_0002], a
+    mov a, 1
+    int x13
+    mov a, x5000
+    int x14
+    mov a, x5000
+    int x10
+halt
+
+done:
+ret
+.org 512
+    .ascii bios read\\n\\0
+.org 1024
+"""
+
+
+@pytest.fixture
+def slow_reads(monkeypatch):
+    "Background reads take long enough for the guest to get ahead of them"
+    load = device.DiskIO.load
+    def slow(self):
+        time.sleep(0.05)
+        load(self)
+    monkeypatch.setattr(device.DiskIO, "load", slow)
+
+
+def test_read_interrupts_when_done(assemble, run_guest, slow_reads):
+    _, output = run_guest(assemble(ASYNC_READ))
+    assert output == "async read\n"
+
+
+def test_bios_waits_for_a_background_read(assemble, run_guest, slow_reads):
+    _, output = run_guest(assemble(BIOS_READ))
+    assert output == "bios read\n"
+
+
+def background_disk(tmp_path) -> tuple:
+    "A disk finishing commands on its worker thread, and the interrupts it raised"
+    path = tmp_path / "disk.img"
+    path.write_bytes(pattern(4))
+    raised = []
+    disk = DiskIO(str(path), interrupt=raised.append)
+    disk.get_command(0x12)
+    disk.write(0x81)
+    disk.write(0x01)
+    return disk, raised
+
+
+def test_failed_job_reports_an_error(tmp_path, monkeypatch):
+    disk, raised = background_disk(tmp_path)
+    def broken(self):
+        raise OSError("gone")
+    monkeypatch.setattr(device.DiskIO, "load", broken)
+    try:
+        set_sector(disk, 1)
+        disk.get_command(0x20)
+        disk.wait()
+        assert disk.status() == 0x32
+        assert raised == [0x181]
+        assert disk.read() == 0
+        disk.get_command(0x30)
+        assert disk.status() == 0
+    finally:
+        disk.close()
+
+
+def test_abort_while_busy(tmp_path, monkeypatch):
+    disk, raised = background_disk(tmp_path)
+    release = threading.Event()
+    load = device.DiskIO.load
+    def held(self):
+        release.wait(5)
+        load(self)
+    monkeypatch.setattr(device.DiskIO, "load", held)
+    try:
+        set_sector(disk, 1)
+        disk.get_command(0x20)
+        assert disk.status() == 0x24
+        # ignored while busy
+        disk.get_command(0x10)
+        assert disk.status() == 0x24
+
+        threading.Timer(0.05, release.set).start()
+        disk.get_command(0xFF)
+        assert disk.status() == 0
+        assert disk.read() == 0
+        # the controller takes commands again
+        set_sector(disk, 2)
+        disk.get_command(0x20)
+        disk.wait()
+        assert bytes(disk.read() for _ in range(SECTOR)) == pattern(4)[2*SECTOR:3*SECTOR]
+    finally:
+        release.set()
+        disk.close()
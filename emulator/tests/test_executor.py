@@ -0,0 +1,48 @@
+from main import Emulator
+
+
+def test_every_defined_opcode_has_a_handler():
+    emulator = Emulator()
+    table = emulator.executor.table
+    assert len(table) == 256
+    for code in range(256):
+        if code in emulator.opcodes.OPCODES:
+            assert table[code] is not None, emulator.opcodes.OPCODES[code]["mnemonic"]
+        else:
+            assert table[code] is None
+
+
+def test_register_compares_set_the_flags(assemble, run_guest):
+    image = assemble("""
+main:
+    mov x, 3
+    mov y, 3
+    cmp x, y
+    jz same
+    mov a, different
+    int x10
+halt
+
+same:
+    mov a, equal
+    int x10
+    mov y, 4
+    cmp x, y
+    jc below
+halt
+
+below:
+    mov a, less
+    int x10
+halt
+
+equal:
+    .ascii equal\\n\\0
+different:
+    .ascii different\\n\\0
+less:
+    .ascii less\\n\\0
+""")
+    emulator, output = run_guest(image)
+    assert output == "equal\nless\n"
+    assert emulator.halt_type == 1
@@ -0,0 +1,149 @@
+from pathlib import Path
+
+import pytest
+
+from device import inputExhausted
+from main import Emulator
+from memory import pageFault
+
+
+EXAMPLES = [
+    ("hello_world", "\n"),
+    ("mov_test", "\n"),
+    ("sxt_test", "\n"),
+    ("test_jmpv", "\n"),
+    ("faults_test", "\n"),
+    ("echo", "hello\nworld\n"),
+    ("textmon", "r1F0\nw200\nhi\nr200\nzz\n"),
+    ("disk", "w1\nhello disk\nr1\nr0\n"),
+]
+
+# pushes 0x1234 with pushr right before a call, the fused pair
+PUSHR_CALL = """
+main:
+    mov a, 0x1234
+    pushr
+    call sub
+    mov a, after
+    int x10
+halt
+
+sub:
+    mov a, called
+    int x10
+ret
+
+after:
+    .ascii after\\n\\0
+called:
+    .ascii called\\n\\0
+"""
+
+
+def state(emulator) -> dict:
+    return {
+        "counter": emulator.counter,
+        "registers": emulator.registers,
+        "flags": (emulator.carry, emulator.zero),
+        "halt_type": emulator.halt_type,
+        "stack": emulator.ram.stack_pos,
+    }
+
+
+def fault_call_push(emulator:Emulator):
+    "Page fault on the push of the call that follows pushr pushing 0x1234, once"
+    ram = emulator.ram
+    pushes = [None]
+    def faulting(push):
+        def wrapper(value:int):
+            if value == 0x1234 and pushes[0] is None:
+                pushes[0] = 0
+            elif pushes[0] is not None:
+                pushes[0] += 1
+                if pushes[0] == 3:
+                    pushes[0] = None
+                    raise pageFault
+            push(value)
+        return wrapper
+    # registers and return addresses are pushed through different methods
+    ram.push_double = faulting(ram.push_double)
+    ram.push_address = faulting(ram.push_address)
+
+
+@pytest.mark.parametrize("name, stdin", EXAMPLES)
+def test_fused_run_matches_unfused(example, run_guest, name, stdin):
+    unfused, unfused_output = run_guest(example(name), stdin, fuse=False)
+    fused, fused_output = run_guest(example(name), stdin)
+    assert fused_output == unfused_output
+    assert state(fused) == state(unfused)
+
+
+def test_bios_routines_are_fused(example, run_guest):
+    emulator, output = run_guest(example("hello_world"))
+    assert output == "Hello, World!\n"
+    names = [name for name, ran, saved in emulator.decoder.fusion.report()]
+    assert "POPR+RET" in names
+
+
+def test_fault_in_fused_call_matches_unfused(assemble, capsys):
+    runs = []
+    for fuse in (False, True):
+        emulator = Emulator()
+        emulator.fuse = fuse
+        fault_call_push(emulator)
+        emulator.main(assemble(PUSHR_CALL), "\n")
+        runs.append((state(emulator), capsys.readouterr().out.replace("\0", ""), emulator))
+
+    (unfused, unfused_output, _), (fused, fused_output, emulator) = runs
+    # the handler returns past the call, which never ran
+    assert unfused_output == "PAGEFAULTafter\n"
+    assert fused_output == unfused_output
+    assert fused == unfused
+    # the pair stopped partway, so it doesn't count as run
+    assert emulator.decoder.fusion.counts["PUSHR+CALL"][0] == 0
+
+
+def test_fault_in_fused_load_matches_unfused(assemble, run_guest):
+    # the third load from the console finds stdin used up, partway through load, compare and jump
+    source = """
+main:
+    mov a, [xFE00_0000]
+    cmp a, 'q
+    jnz main
+halt
+"""
+    unfused, unfused_output = run_guest(assemble(source), "ab", fuse=False)
+    fused, fused_output = run_guest(assemble(source), "ab")
+    assert fused_output == unfused_output == "ab"
+    assert state(fused) == state(unfused)
+
+
+def test_fault_in_fused_pair_counts_like_unfused(assemble):
+    counts = []
+    for fuse in (False, True):
+        emulator = Emulator()
+        emulator.fuse = fuse
+        fault_call_push(emulator)
+        emulator.boot(Path(assemble(PUSHR_CALL)).read_bytes(), "\n", output=bytearray())
+        counts.append(emulator.run())
+        assert counts[-1] == emulator.executed
+    assert counts[0] == counts[1]
+
+
+def test_fault_in_fused_load_counts_like_unfused(assemble):
+    image = Path(assemble("""
+main:
+    mov a, [xFE00_0000]
+    cmp a, 'q
+    jnz main
+halt
+""")).read_bytes()
+    counts = []
+    for fuse in (False, True):
+        emulator = Emulator()
+        emulator.fuse = fuse
+        emulator.boot(image, "ab", output=bytearray())
+        with pytest.raises(inputExhausted):
+            emulator.run()
+        counts.append(emulator.executed)
+    assert counts[0] == counts[1] > 0
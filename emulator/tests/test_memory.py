@@ -0,0 +1,262 @@
+import pytest
+
+from device import Device, Port
+from main import Emulator, executionError
+from memory import pageFault, Ram
+
+
+def test_wide_accesses_match_single_bytes():
+    ram = Ram()
+    # inside a page, then straddling page boundaries at every split
+    for address in (0x1010, 0x1FFF, 0x2FFE, 0x3FFD, 0x4FF9):
+        ram.store_quad(address, 0x1122_3344_5566_7788)
+        assert [ram.load(address + idx) for idx in range(8)] == [0x88, 0x77, 0x66, 0x55, 0x44, 0x33, 0x22, 0x11]
+        assert ram.load_quad(address) == 0x1122_3344_5566_7788
+        assert ram.load_double(address + 4) == 0x1122_3344
+        assert ram.load_word(address + 6) == 0x1122
+
+        ram.store_double(address, 0xAABB_CCDD)
+        ram.store_word(address + 4, 0xEEFF)
+        assert ram.load_quad(address) == 0x1122_EEFF_AABB_CCDD
+    assert all(isinstance(frame, bytearray) for frame in ram.data.values())
+
+
+def test_reads_do_not_allocate():
+    ram = Ram()
+    assert ram.load(0x5000) == 0
+    assert ram.load_double(0x6FFE) == 0
+    assert ram.load_quad(0x7FF_FFF0) == 0
+    assert ram.data == {}
+
+    ram.store(0x5001, 1)
+    assert list(ram.data) == [5]
+    assert ram.load_word(0x5000) == 0x100
+
+
+def test_stack_crosses_pages():
+    ram = Ram()
+    ram.stack_start = 0x2010
+    values = [0x1000_0000 + idx for idx in range(16)]
+    for value in values:
+        ram.push_double(value)
+    assert set(ram.data) == {1, 2}
+    assert [ram.pop_double() for _ in values] == values[::-1]
+    assert ram.stack_pos == 0
+
+
+def test_tlb_writes_reach_the_page():
+    ram = Ram()
+    for page in range(20):
+        ram.store(page << 12, page)
+        ram.store_double(page << 12 | 4, 0xDEAD_0000 + page)
+        assert len(ram.tlb) <= ram.tlb_size
+    for page in range(20):
+        assert bytes(ram.data[page][:8]) == bytes([page, 0, 0, 0]) + (0xDEAD_0000 + page).to_bytes(4, "little")
+
+
+def test_stores_to_a_cached_page_reach_its_code():
+    emulator = Emulator()
+    ram = emulator.ram
+    # ldxi 1, halt: the page goes through the TLB before it holds any decoded code
+    ram.store_double(0x2000, 0x0000_0048)
+    ram.store_double(0x2002, 1)
+    ram.store_word(0x2006, 0x00FF)
+    emulator.counter = 0x2000
+    emulator.run()
+    assert emulator.registers[1] == 1
+
+    ram.store_double(0x2002, 5)
+    emulator.counter = 0x2000
+    emulator.halt_type = None
+    emulator.running = True
+    emulator.run()
+    assert emulator.registers[1] == 5
+
+
+class Latch(Device):
+    "One read/write port holding the last byte written"
+    def __init__(self):
+        self.value = 0
+        super().__init__()
+
+    def set_port(self, register_port):
+        port = Port()
+        port.read = lambda: self.value
+        port.write = self.set
+        register_port(port)
+
+    def set(self, value:int):
+        self.value = value
+
+
+def test_device_at_an_address():
+    ram = Ram()
+    ram.store(0x4000_0010, 9)
+    latch = Latch()
+    ram.register_device(latch, 0x4000_0000)
+
+    ram.store(0x4000_0000, 7)
+    assert latch.value == 7
+    assert ram.load(0x4000_0000) == 7
+    # unclaimed addresses in a device page read 0 and drop writes
+    ram.store(0x4000_0010, 3)
+    assert ram.load(0x4000_0010) == 0
+    assert 0x40000 not in ram.data
+
+
+def test_bulk_operations_span_pages():
+    ram = Ram()
+    data = bytes(range(256)) * 40
+    ram.write_range(0x1F00, data)
+    assert ram.read_range(0x1F00, len(data)) == data
+    assert ram.load_double(0x2000) == 0x0302_0100
+
+    ram.fill(0x2800, 0x1000, 0xAA)
+    assert ram.read_range(0x27FF, 0x1002) == data[0x8FF:0x900] + b"\xAA" * 0x1000 + data[0x1900:0x1901]
+
+    # overlapping both ways round, like memmove
+    expected = bytearray(ram.read_range(0x1F00, 0x3000))
+    expected[0x80:0x2080] = expected[0:0x2000]
+    ram.copy(0x1F80, 0x1F00, 0x2000)
+    assert ram.read_range(0x1F00, 0x3000) == expected
+    expected[0:0x2000] = expected[0x80:0x2080]
+    ram.copy(0x1F00, 0x1F80, 0x2000)
+    assert ram.read_range(0x1F00, 0x3000) == expected
+
+
+def test_bulk_operations_leave_untouched_pages_alone():
+    ram = Ram()
+    assert ram.read_range(0x10000, 0x3000) == bytes(0x3000)
+    ram.fill(0x10000, 0x3000)
+    ram.write_range(0x20000, bytes(0x2000))
+    assert ram.data == {}
+
+
+FAR = 0x1_2345_0000
+
+
+def quad(value:int) -> bytes:
+    return value.to_bytes(8, "little")
+
+
+def wide_emulator(**settings) -> Emulator:
+    "An emulator already in 64 bit mode, with its stack and IVT above 4 GiB"
+    emulator = Emulator()
+    for name, value in settings.items():
+        setattr(emulator, name, value)
+    emulator.blocksize = 4
+    emulator.ram.set_blocksize(4)
+    emulator.decoder.flush()
+    emulator.ram.stack_start = 0x2_0000_0000
+    emulator.ram.int_start = 0x3_0000_0000
+    # far: ldxi 7, ret
+    emulator.ram.write_range(FAR, bytes([0x48, 0]) + quad(7) + bytes([0x37, 0]))
+    return emulator
+
+
+WIDE_MODES = [{"fuse": False}, {}, {"translate": True}]
+
+
+def test_high_addresses_do_not_alias_low_ones():
+    ram = Ram()
+    ram.store(0x1_0000_1000, 5)
+    assert ram.load(0x1000) == 5
+    ram = Ram()
+    ram.set_blocksize(4)
+    ram.store(0x1_0000_1000, 5)
+    assert ram.load(0x1000) == 0
+    assert ram.load(0x1_0000_1000) == 5
+
+
+@pytest.mark.parametrize("settings", WIDE_MODES)
+def test_call_and_return_across_4_gib(settings):
+    emulator = wide_emulator(**settings)
+    # acall far, ldai 1, halt
+    emulator.ram.write_range(0x1000, bytes([0x38, 0]) + quad(FAR) + bytes([0x47, 0]) + quad(1) + bytes([0xFF, 0]))
+    emulator.counter = 0x1000
+    emulator.run()
+    assert emulator.registers[:2] == [1, 7]
+    assert emulator.halt_type == 1
+    assert emulator.ram.stack_pos == 0
+
+
+@pytest.mark.parametrize("settings", WIDE_MODES)
+def test_interrupts_reach_a_handler_above_4_gib(settings):
+    emulator = wide_emulator(**settings)
+    emulator.ram.register_int(0x105, FAR)
+    assert emulator.ram.find_int(0x105) == FAR
+    # int x105, ldai 1, halt
+    emulator.ram.write_range(0x1000, bytes([0x80, 0]) + quad(0x105) + bytes([0x47, 0]) + quad(1) + bytes([0xFF, 0]))
+    emulator.counter = 0x1000
+    emulator.run()
+    assert emulator.registers[:2] == [1, 7]
+    assert emulator.ram.stack_pos == 0
+
+    # the same handler raised by hardware, returning to ldai 1
+    emulator.registers[:2] = [0, 0]
+    emulator.interrupt(0x105)
+    emulator.halt_type = None
+    emulator.counter = 0x100A
+    emulator.run()
+    assert emulator.registers[:2] == [1, 7]
+    assert emulator.ram.stack_pos == 0
+
+
+def test_allocation_past_the_limit_faults():
+    ram = Ram()
+    ram.max_pages = 2
+    ram.store(0x1000, 1)
+    ram.store(0x2000, 1)
+    with pytest.raises(pageFault):
+        ram.store(0x3000, 1)
+    # reading never allocates, so it can't fault
+    assert ram.load(0x3000) == 0
+    stats = ram.stats()
+    assert stats["pages"] == 2
+    assert stats["bytes"] == 0x2000
+    assert stats["max_pages"] == 2
+
+
+# prints once first, so the BIOS is done allocating its own pages by the store
+TOUCH = """
+main:
+    mov a, go
+    int x10
+    mov a, 1
+    mov [x8000], a
+    mov a, ok
+    int x10
+halt
+
+go:
+    .ascii go\\n\\0
+ok:
+    .ascii ok\\n\\0
+"""
+
+
+def test_guest_gets_a_page_fault(assemble, capsys):
+    image = assemble(TOUCH)
+    emulator = Emulator()
+    emulator.main(image, "\n")
+    assert capsys.readouterr().out.replace("\0", "") == "go\nok\n"
+    pages = len(emulator.ram.data)
+
+    # one page short: the store faults, the BIOS reports it and carries on past the store
+    emulator = Emulator()
+    emulator.ram.max_pages = pages - 1
+    emulator.main(image, "\n")
+    assert capsys.readouterr().out.replace("\0", "") == "go\nPAGEFAULTok\n"
+    assert emulator.ram.stats()["pages"] == pages - 1
+
+
+def test_page_fault_without_a_handler_stops():
+    emulator = Emulator()
+    ram = emulator.ram
+    ram.int_start = 0x10000
+    # sta x5000, halt
+    ram.write_range(0x1000, bytes([0x84, 0]) + (0x5000).to_bytes(4, "little") + bytes([0xFF, 0]))
+    ram.max_pages = len(ram.data)
+    emulator.counter = 0x1000
+    with pytest.raises(executionError, match="page fault handler"):
+        emulator.run()
@@ -0,0 +1,112 @@
+import pytest
+
+from device import inputExhausted
+from main import executionError
+
+
+def test_plain_run_keeps_no_timings(example, run_guest):
+    emulator, output = run_guest(example("hello_world"))
+    assert output == "Hello, World!\n"
+    assert emulator.time == []
+
+
+def test_timed_run_matches_plain_run(example, run_guest):
+    plain, plain_output = run_guest(example("textmon"), "r1F0\nw200\nhi\nr200\nzz\n")
+    timed, timed_output = run_guest(example("textmon"), "r1F0\nw200\nhi\nr200\nzz\n", do_time=True)
+    assert timed_output == plain_output
+    assert (timed.counter, timed.registers, timed.ram.stack_pos) == (plain.counter, plain.registers, plain.ram.stack_pos)
+    assert len(timed.time) > 0
+
+
+def test_recursion_blocking_stops_a_spinning_guest(assemble, run_guest):
+    image = assemble("""
+main:
+    jmp main
+""")
+    with pytest.raises(executionError):
+        run_guest(image, block_recursion=True, recursion_limit=100)
+
+
+MODES = [
+    {"fuse": False},
+    {},
+    {"translate": True},
+    {"do_time": True},
+]
+
+COUNTING = """
+main:
+    mov x, 0
+    mov y, 1
+loop:
+    add
+    mov x, a
+    cmp a, 300
+    jnz loop
+    mov a, done
+    int x10
+halt
+
+done:
+    .ascii done\\n\\0
+"""
+
+
+@pytest.mark.parametrize("settings", MODES)
+def test_budget_stops_at_exactly_that_many_instructions(assemble, boot_guest, settings):
+    image = assemble(COUNTING)
+    whole, whole_output = boot_guest(image, **settings)
+    total = whole.run()
+    assert whole.halt_type == 1
+    assert total == whole.executed
+
+    emulator, output = boot_guest(image, **settings)
+    done = 0
+    for budget in (1, 7, 50, 333, 1000):
+        ran = emulator.run(instructions=budget)
+        assert ran == budget
+        done += ran
+        assert emulator.executed == done
+    done += emulator.run()
+    assert done == emulator.executed == total
+    assert output == whole_output
+    assert output.replace(b"\0", b"") == b"done\n"
+
+
+def test_every_loop_counts_the_same(assemble, boot_guest):
+    image = assemble(COUNTING)
+    counts = []
+    for settings in MODES:
+        emulator, _ = boot_guest(image, **settings)
+        emulator.run()
+        counts.append(emulator.executed)
+    assert len(set(counts)) == 1
+
+
+@pytest.mark.parametrize("settings", MODES)
+def test_instructions_are_counted_when_input_runs_out(example, boot_guest, settings):
+    emulator, output = boot_guest(example("echo"), "hello\n", **settings)
+    with pytest.raises(inputExhausted):
+        emulator.run()
+    unfused, _ = boot_guest(example("echo"), "hello\n", fuse=False)
+    with pytest.raises(inputExhausted):
+        unfused.run()
+    assert emulator.executed > 0
+    assert emulator.executed == unfused.executed
+
+
+def test_output_goes_to_the_buffer(example, boot_guest, capsys):
+    emulator, output = boot_guest(example("hello_world"))
+    emulator.run()
+    assert output.replace(b"\0", b"") == b"Hello, World!\n"
+    assert capsys.readouterr().out == ""
+
+
+def test_time_budget_returns_control(assemble, boot_guest):
+    emulator, _ = boot_guest(assemble("""
+main:
+    jmp main
+"""))
+    ran = emulator.run(nanoseconds=20_000_000)
+    assert ran > 0
+    assert emulator.running and emulator.halt_type is None
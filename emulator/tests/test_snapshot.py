@@ -0,0 +1,56 @@
+import pytest
+
+from device import inputExhausted
+
+
+TEXTMON_INPUT = "r1F0\nw200\nhi\nr200\nzz\n"
+
+
+def machine(emulator) -> tuple:
+    ram = emulator.ram
+    pages = {page: bytes(frame) for page, frame in ram.data.items()}
+    return (emulator.counter, emulator.registers.copy(), emulator.carry, emulator.zero, ram.stack_pos, pages)
+
+
+def test_restore_runs_the_same_way_again(example, boot_guest):
+    emulator, output = boot_guest(example("textmon"), TEXTMON_INPUT)
+    emulator.run(instructions=3000)
+    snapshot = emulator.snapshot()
+    printed = len(output)
+    before = machine(emulator)
+
+    with pytest.raises(inputExhausted):
+        emulator.run()
+    first = bytes(output[printed:])
+    after = machine(emulator)
+    assert first
+
+    emulator.restore(snapshot)
+    assert machine(emulator) == before
+    assert len(output) == printed
+    with pytest.raises(inputExhausted):
+        emulator.run()
+    assert bytes(output[printed:]) == first
+    assert machine(emulator) == after
+
+
+def test_pages_are_copied_on_first_write(assemble, boot_guest):
+    emulator, _ = boot_guest(assemble("""
+main:
+    mov a, 0x5A
+    mov [x3000], a
+halt
+"""))
+    emulator.run(instructions=2)
+    snapshot = emulator.snapshot()
+    ram = emulator.ram
+    assert ram.shared == set(ram.data)
+    assert not ram.dirty
+
+    emulator.run()
+    assert ram.load(0x3000) == 0x5A
+    assert 3 in ram.dirty
+    # what the snapshot holds didn't change with it
+    emulator.restore(snapshot)
+    assert ram.load(0x3000) == 0
+    assert emulator.halt_type is None
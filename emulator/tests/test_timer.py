@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from device import TIMER_BASE
+
+
+# counts five ticks, printing a dot on each, then stops the timer
+TICKS = """
+const timer_period xFE00_0200
+const timer_vector xFE00_0204
+const timer_control xFE00_0206
+const count x4000
+
+main:
+    intr 0x180, tick
+    mov a, 10000
+    movd [timer_period], a
+    mov a, 0x180
+    movw [timer_vector], a
+    mov a, 1
+    mov [timer_control], a
+wait:
+    mov x, [count]
+    cmp x, 5
+    jnz wait
+    mov a, 0
+    mov [timer_control], a
+    mov a, text
+    int x10
+halt
+
+tick:
+    pushr
+    mov x, [count]
+    mov y, 1
+    add
+    mov [count], a
+    mov a, dot
+    int x10
+    mov a, 0x30
+    mov [timer_control], a
+    popr
+ret
+
+dot:
+    .ascii .\\0
+text:
+    .ascii done\\n\\0
+"""
+
+
+@pytest.mark.parametrize("settings", [{"fuse": False}, {}, {"translate": True}])
+def test_timer_interrupts(assemble, run_guest, settings):
+    emulator, output = run_guest(assemble(TICKS), **settings)
+    assert output == ".....done\n"
+    assert emulator.timer.mode == 0
+    assert emulator.timer.stop is None
+
+
+def test_timer_registers_read_back(assemble, boot_guest):
+    emulator, _ = boot_guest(assemble(TICKS))
+    ram = emulator.ram
+    ram.store_double(TIMER_BASE, 250)
+    ram.store_word(TIMER_BASE + 0x04, 0xFFFF)
+    values = [ram.load(TIMER_BASE + offset) for offset in range(0x0C)]
+    assert all(isinstance(value, int) for value in values)
+    assert ram.load_double(TIMER_BASE) == 250
+    assert ram.load_word(TIMER_BASE + 0x04) == 0x1FF
+    assert values[0x06] == 0
+    assert ram.load_double(TIMER_BASE + 0x08) == 0
+
+    # one-shot: ticks once, then reads as stopped
+    ram.store(TIMER_BASE + 0x06, 0x02)
+    assert ram.load(TIMER_BASE + 0x06) == 2
+    deadline = time.monotonic() + 5
+    while ram.load(TIMER_BASE + 0x06) and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert ram.load(TIMER_BASE + 0x06) == 0
+    assert ram.load_double(TIMER_BASE + 0x08) == 1
+    emulator.close()
@@ -0,0 +1,48 @@
+import pytest
+
+
+EXAMPLES = [
+    ("hello_world", "\n"),
+    ("mov_test", "\n"),
+    ("sxt_test", "\n"),
+    ("test_jmpv", "\n"),
+    ("faults_test", "\n"),
+    ("echo", "hello\nworld\n"),
+    ("textmon", "r1F0\nw200\nhi\nr200\nzz\n"),
+    ("disk", "w1\nhello disk\nr1\nr0\n"),
+]
+
+
+def state(emulator) -> dict:
+    return {
+        "counter": emulator.counter,
+        "registers": emulator.registers,
+        "flags": (emulator.carry, emulator.zero),
+        "halt_type": emulator.halt_type,
+        "stack": emulator.ram.stack_pos,
+    }
+
+
+@pytest.mark.parametrize("name, stdin", EXAMPLES)
+def test_translated_run_matches_interpreter(example, run_guest, name, stdin):
+    interpreted, interpreted_output = run_guest(example(name), stdin)
+    translated, translated_output = run_guest(example(name), stdin, translate=True)
+    assert translated_output == interpreted_output
+    assert state(translated) == state(interpreted)
+    assert any(block is not None for block in translated.translator.blocks.values())
+
+
+def test_block_sees_its_own_stores(assemble, run_guest):
+    # the store patches the block it is part of, what follows it has to run the new code
+    emulator, _ = run_guest(assemble("""
+main:
+patch:
+    mov x, 1
+    mov a, 7
+    mov [patch+2], a
+    cmp x, 7
+    jnz main
+halt
+"""), translate=True)
+    assert emulator.registers[1] == 7
+    assert emulator.halt_type == 1
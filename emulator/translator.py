@@ -0,0 +1,277 @@
+from typing import TYPE_CHECKING
+from executor import sign_extend_word, sign_extend_double, sign_extend_quad, variable_mov_variant_get
+
+REGISTERS = "axy"
+SIZES = {"": "", "W": "_word", "D": "_double", "Q": "_quad"}
+
+# instructions that end a block, they decide the next counter themselves
+BRANCHES = {
+    "AJMP","AJZ","AJNZ","AJC","AJNC",
+    "ACALL","ABZ","ABNZ","ABC","ABNC",
+    "JMP","JZ","JNZ","JC","JNC",
+    "CALL","BZ","BNZ","BC","BNC",
+    "JMPV","CALLV","RET","INT","HALT","HALTZ",
+}
+
+CONDITIONS = {"Z": "zero", "NZ": "not zero", "C": "carry", "NC": "not carry"}
+
+class Translator:
+    "Compiles basic blocks of guest code into Python functions"
+    def __init__(self, emulator:"Emulator"):
+        self.emulator = emulator
+        self.decoder = emulator.decoder
+        self.ram = emulator.ram
+
+        self.max_length = 64
+
+        # block start -> compiled block, None when it can't be translated
+        self.blocks:dict[int,object] = {}
+        # pc -> every block start whose block includes that instruction
+        self.containing:dict[int,list[int]] = {}
+        # block start -> the flag that stops a block after it overwrites itself
+        self.alive:dict[int,list[bool]] = {}
+
+        self.decoder.on_drop = self.drop
+
+    def translate(self, start:int):
+        "Compile the block starting at `start`, None if the interpreter has to run it"
+        emulator = self.emulator
+        # widest instruction there is, two operands at the current block size
+        span = 2 + 4*emulator.blocksize
+        device_pages = self.ram.device_pages
+        mask = self.ram.mask
+
+        lines = []
+        pcs = []
+        # counter left just past an instruction -> instructions run up to and including it
+        ends = {}
+        pc = start
+        end = None
+        while len(pcs) < self.max_length:
+            if ((pc & mask) >> 12) in device_pages or (((pc+span-1) & mask) >> 12) in device_pages:
+                break
+            try:
+                handler, variant, params, length = self.decoder.cache[pc]
+            except KeyError:
+                handler, variant, params, length = self.decoder.decode(pc)
+            if pc not in self.decoder.cache:
+                break
+            info = emulator.opcodes.OPCODES.get(self.ram.load(pc))
+            if handler is None or info is None:
+                break
+            name = info["mnemonic"]
+            following = pc + length
+
+            if name in BRANCHES:
+                code = self.emit_branch(name, params, pc, following, len(pcs)+1)
+            else:
+                code = self.emit(name, variant, params)
+            if code is None:
+                break
+
+            pcs.append(pc)
+            ends[following] = len(pcs)
+            lines.append(f"pc = {following}")
+            lines.extend(code.split("\n"))
+            if name in BRANCHES:
+                end = pc
+                break
+            # a store can overwrite the block, or reach a device that raises an interrupt
+            if self.writes(name):
+                lines.append("if not alive[0] or not emulator.running:")
+                lines.extend("    "+line for line in self.exit(str(following), len(pcs)))
+            pc = following
+
+        if not pcs:
+            # remember the refusal, unless it came from device space
+            if pc in self.decoder.cache:
+                self.blocks[start] = None
+                self.containing.setdefault(pc, []).append(start)
+            return None
+
+        if end is None:
+            lines.extend(self.exit(str(pc), len(pcs)))
+
+        alive = [True]
+        block = self.compile(start, lines, alive)
+        block.length = len(pcs)
+        block.ends = ends
+
+        self.blocks[start] = block
+        self.alive[start] = alive
+        for pc in pcs:
+            self.containing.setdefault(pc, []).append(start)
+        return block
+
+    def compile(self, start:int, lines:list[str], alive:list[bool]):
+        ram = self.ram
+        mask = (1 << (self.emulator.blocksize * 16)) - 1
+        body = "\n".join("        "+line for line in lines)
+        source = (
+            "def block():\n"
+            "    a, x, y = registers\n"
+            "    carry = emulator.carry\n"
+            "    zero = emulator.zero\n"
+            f"    pc = {start}\n"
+            "    try:\n"
+            f"{body}\n"
+            "    except BaseException:\n"
+            "        registers[0] = a; registers[1] = x; registers[2] = y\n"
+            "        emulator.carry = carry; emulator.zero = zero\n"
+            "        emulator.counter = pc\n"
+            "        raise\n"
+        ).replace("MASK", str(mask))
+
+        namespace = {
+            "emulator": self.emulator,
+            "registers": self.emulator.registers,
+            "ram": ram,
+            "alive": alive,
+            "load": ram.load, "load_word": ram.load_word,
+            "load_double": ram.load_double, "load_quad": ram.load_quad,
+            "store": ram.store, "store_word": ram.store_word,
+            "store_double": ram.store_double, "store_quad": ram.store_quad,
+            "push_double": ram.push_double, "pop_double": ram.pop_double,
+            "push_address": ram.push_address, "pop_address": ram.pop_address,
+            "sign_extend_word": sign_extend_word,
+            "sign_extend_double": sign_extend_double,
+            "sign_extend_quad": sign_extend_quad,
+        }
+        exec(compile(source, f"<block x{start:X}>", "exec"), namespace)
+        return namespace["block"]
+
+    def exit(self, target:str, count:int) -> list[str]:
+        "Leave the block for target, returning the count of instructions it ran"
+        return [
+            "registers[0] = a; registers[1] = x; registers[2] = y",
+            "emulator.carry = carry; emulator.zero = zero",
+            f"emulator.counter = {target}",
+            f"return {count}",
+        ]
+
+    def writes(self, name:str) -> bool:
+        "Whether an instruction can store into ram (and so into code) or into device ports"
+        return name.startswith(("ST","MOV","PUSH","INTR"))
+
+    def emit(self, name:str, variant:int, params:tuple):
+        "Python source for a straight-line instruction, None if it can't be translated"
+        p = params
+
+        for suffix, size in SIZES.items():
+            if name == f"MOV{suffix}":
+                return f"store{size}({p[0]}, load{size}({p[1]}))"
+            if name == f"LDV{suffix}":
+                source, dest = variable_mov_variant_get(variant)
+                if dest == 3:
+                    return None
+                address = "ram.stack_start" if source == 3 else REGISTERS[source]
+                return f"{REGISTERS[dest]} = load{size}({address})"
+            if name == f"STV{suffix}":
+                source, dest = variable_mov_variant_get(variant)
+                if source == 3:
+                    return None
+                address = "ram.stack_start" if dest == 3 else REGISTERS[dest]
+                return f"store{size}({address}, {REGISTERS[source]})"
+            for register, reg in zip("AXY", REGISTERS):
+                if name == f"LD{register}{suffix}":
+                    return f"{reg} = load{size}({p[0]})"
+                if name == f"ST{register}{suffix}":
+                    return f"store{size}({p[0]}, {reg})"
+
+        # result in A, then carry/zero like Emulator.correct_register
+        corrected = "carry = not 0 <= a <= MASK; a &= MASK; zero = a == 0"
+        match name:
+            case "ADD": return "a = x + y\n" + corrected
+            case "SUB": return "a = x - y\n" + corrected
+            case "MUL": return "a = x * y\n" + corrected
+            case "DIV": return "a = x // y\n" + corrected
+            case "MOD": return "a = x % y\n" + corrected
+            case "SHL": return "a = x << y\n" + corrected
+            case "SHR": return "a = x >> y\n" + corrected
+            case "SXTW": return "a = sign_extend_word(a)"
+            case "SXTD": return "a = sign_extend_double(a)"
+            case "SXTQ": return "a = sign_extend_quad(a)"
+            case "AND": return "a = x & y"
+            case "OR": return "a = x | y"
+            case "XOR": return "a = x ^ y"
+            case "NOT": return "a = ~x"
+            case "SHLB": return "a = x << 8"
+            case "SHRB": return "a = x >> 8"
+            case "PUSHR": return "push_double(a); push_double(x); push_double(y)"
+            case "POPR": return "y = pop_double(); x = pop_double(); a = pop_double()"
+            case "INTR": return f"ram.register_int({p[0]}, {p[1]})"
+
+        for register, reg in zip("AXY", REGISTERS):
+            if name == f"LD{register}I":
+                return f"{reg} = {p[0]}"
+            if name == f"CMP{register}":
+                return f"carry = {reg} < {p[0]}; zero = {reg} == {p[0]}"
+            if name == f"PUSH{register}":
+                return f"push_double({reg})"
+            if name == f"POP{register}":
+                return f"{reg} = pop_double()"
+            for other, other_reg in zip("AXY", REGISTERS):
+                if name == f"CM{register}{other}":
+                    return f"carry = {reg} < {other_reg}; zero = {reg} == {other_reg}"
+                if name == f"MV{register}{other}":
+                    return f"{other_reg} = {reg}"
+
+        return None
+
+    def emit_branch(self, name:str, params:tuple, pc:int, following:int, count:int) -> str:
+        "Python source for a block-ending instruction, including the exit, the block runs count instructions"
+        if name in ("HALT","HALTZ"):
+            halt_type = 1 if name == "HALT" else 2
+            return "\n".join([f"emulator.running = False; emulator.halt_type = {halt_type}"] + self.exit(str(following), count))
+        if name == "RET":
+            return "\n".join(self.exit("pop_address()", count))
+        if name == "JMPV":
+            return "\n".join(self.exit("a", count))
+        if name == "CALLV":
+            return "\n".join([f"push_address({following})"] + self.exit("a", count))
+        if name == "INT":
+            return "\n".join([f"target = ram.find_int({params[0]})", f"push_address({following})"] + self.exit("target", count))
+
+        if name.startswith("A"):
+            target = params[0]
+            name = name[1:]
+        else:
+            target = pc + params[0]
+
+        # JMP/CALL are unconditional, the others carry a condition suffix
+        if name in ("JMP","CALL"):
+            kind, condition = name, None
+        else:
+            kind, condition = ("JMP" if name[0] == "J" else "CALL"), CONDITIONS[name[1:]]
+
+        lines = []
+        if condition is None:
+            if kind == "CALL":
+                lines.append(f"push_address({following})")
+            return "\n".join(lines + self.exit(str(target), count))
+
+        lines.append(f"if {condition}:")
+        if kind == "CALL":
+            lines.append(f"    push_address({following})")
+        lines.extend("    "+line for line in self.exit(str(target), count))
+        lines.extend(self.exit(str(following), count))
+        return "\n".join(lines)
+
+    def drop(self, pc:int):
+        "Forget blocks built on an instruction the decoder dropped, None forgets all"
+        if pc is None:
+            for alive in self.alive.values():
+                alive[0] = False
+            self.blocks.clear()
+            self.containing.clear()
+            self.alive.clear()
+            return
+
+        for start in self.containing.pop(pc, ()):
+            self.blocks.pop(start, None)
+            alive = self.alive.pop(start, None)
+            if alive:
+                alive[0] = False
+
+if TYPE_CHECKING:
+    from main import Emulator